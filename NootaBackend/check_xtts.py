@@ -2,12 +2,22 @@
 """
 XTTS v2 Simple HTTP Server - No Dependencies Hell
 Works with Python 3.11+ installed locally
+
+Usage:
+    python check_xtts.py                  # check the install and load the model
+    python check_xtts.py --bench          # JSON benchmark: import/load time, latency, RTF, memory
+    python check_xtts.py --bench --languages en,ar --runs 5 --output bench.json
 """
 
 import os
 import sys
 import json
+import time
 import logging
+import argparse
+import platform
+import statistics
+import contextlib
 from pathlib import Path
 
 # Configure logging
@@ -17,7 +27,141 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Clauses per benchmark text
+BENCH_LENGTHS = {'short': 1, 'medium': 3, 'long': 8}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_language(engine, language, phrase, runs):
+    """Cold (first) and warm latency plus real-time factor per text length"""
+    results = {}
+    for name, clauses in BENCH_LENGTHS.items():
+        text = ', '.join([phrase] * clauses) + '.'
+        timings = []
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            wav, stats = engine.synthesize(text, language=language, return_stats=True)
+            timings.append((time.perf_counter() - start, len(wav) / engine.sample_rate,
+                            stats['audio_tokens']))
+
+        (cold, cold_audio, _), warm = timings[0], timings[1:]
+        warm_seconds = sum(t[0] for t in warm)
+        warm_audio = sum(t[1] for t in warm)
+        results[name] = {
+            'chars': len(text),
+            'cold_seconds': round(cold, 3),
+            'cold_rtf': round(cold / cold_audio, 3) if cold_audio else None,
+            'warm_seconds': round(statistics.median(t[0] for t in warm), 3) if warm else None,
+            'audio_seconds': round(statistics.median(t[1] for t in warm or timings), 2),
+            'audio_tokens': round(statistics.median(t[2] for t in warm or timings)),
+            'rtf': round(warm_seconds / warm_audio, 3) if warm_audio else None,
+        }
+    return results
+
+
+def bench(args):
+    """Benchmark import, load and synthesis; returns a JSON-serializable report"""
+    imports = {}
+    start = time.perf_counter()
+    import torch
+    imports['torch'] = round(time.perf_counter() - start, 2)
+    start = time.perf_counter()
+    import TTS
+    imports['TTS'] = round(time.perf_counter() - start, 2)
+    start = time.perf_counter()
+    from xtts_engine import WARMUP_PHRASES, XTTSEngine
+    from xtts_text import SUPPORTED_LANGUAGES
+    imports['engine'] = round(time.perf_counter() - start, 2)
+
+    # Cold latency is part of the measurement, so skip the engine's own warmup
+    os.environ['XTTS_WARMUP'] = '0'
+    engine = XTTSEngine()
+    start = time.perf_counter()
+    engine.load()
+    load_seconds = time.perf_counter() - start
+    rss_after_load = peak_rss_mb()
+
+    codes = args.languages.split(',') if args.languages else list(SUPPORTED_LANGUAGES)
+    languages = {}
+    first_request = None
+    for code in codes:
+        code = code.strip()
+        language = SUPPORTED_LANGUAGES.get(code, code)
+        phrase = WARMUP_PHRASES.get(language, WARMUP_PHRASES['en'])
+        logger.info(f"Benchmarking {language}...")
+        try:
+            languages[code] = bench_language(engine, language, phrase, args.runs)
+        except Exception as e:
+            languages[code] = {'error': str(e)}
+            continue
+        if first_request is None:
+            first_request = languages[code]['short']['cold_seconds']
+
+    rtfs = [length['rtf'] for result in languages.values() if 'error' not in result
+            for length in result.values() if length['rtf'] is not None]
+    info = engine.info()
+    return {
+        'host': {
+            'hostname': platform.node(),
+            'platform': platform.platform(),
+            'cpu': info['cpu_capabilities'].get('model'),
+            'cores': info['cpu_capabilities'].get('cores'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'tts': getattr(TTS, '__version__', None),
+            'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        },
+        'engine': {
+            'backend': engine.backend,
+            'device': engine.device,
+            'precision': engine.precision,
+            'decoder': info['decoder'].get('mode'),
+            'model_source': engine.model_source,
+        },
+        'runs': args.runs,
+        'import_seconds': imports,
+        'load_seconds': round(load_seconds, 2),
+        'first_request_seconds': first_request,
+        'languages': languages,
+        'median_rtf': round(statistics.median(rtfs), 3) if rtfs else None,
+        'memory': {
+            'peak_rss_mb_after_load': rss_after_load,
+            'peak_rss_mb': peak_rss_mb(),
+            'cuda_peak_mb': round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+                            if torch.cuda.is_available() else None,
+        },
+    }
+
+
 def main():
+    parser = argparse.ArgumentParser(description="XTTS v2 setup check and benchmark")
+    parser.add_argument('--bench', action='store_true', help="print a JSON benchmark report")
+    parser.add_argument('--languages', help="comma-separated app language codes (default: all)")
+    parser.add_argument('--runs', type=int, default=3, help="warm runs per text length")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.bench:
+        # TTS prints progress to stdout; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = bench(args)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        return 0
+
     print("\n" + "="*60)
     print("  XTTS v2 Setup Check")
     print("="*60 + "\n")
@@ -98,6 +98,24 @@ export function cleanupTempFile(filePath) {
   }
 }
 
+/**
+ * File name of a message audio chunk inside uploads/audio/chunks
+ * @param {Object} metadata - {messageId, languageCode, chunkIndex}
+ * @returns {string}
+ */
+export function getChunkFileName({ messageId, languageCode, chunkIndex }) {
+  return `${languageCode}_${messageId}_chunk${chunkIndex}.wav`;
+}
+
+/**
+ * Public URL of a stored audio chunk
+ * @param {string} chunkFileName
+ * @returns {string} Local URL (http://localhost:5001/audio/chunks/...)
+ */
+export function getChunkUrl(chunkFileName) {
+  return `${BACKEND_URL}/audio/chunks/${chunkFileName}`;
+}
+
 /**
  * Upload generated audio chunk to local backend storage
  * @param {Buffer} audioBuffer - Generated audio
@@ -109,7 +127,7 @@ export async function uploadAudioChunk(audioBuffer, metadata) {
     const { messageId, languageCode, chunkIndex, totalChunks, roomId } = metadata;
 
     // Create filename
-    const chunkFileName = `${languageCode}_${messageId}_chunk${chunkIndex}.wav`;
+    const chunkFileName = getChunkFileName(metadata);
     
     // Get the uploads directory path
     // Navigate from src/services/audioManager.js to /uploads
@@ -131,7 +149,7 @@ export async function uploadAudioChunk(audioBuffer, metadata) {
     logger.info(` Chunk saved successfully: ${chunkFileName} (${fileSize} bytes) to ${chunkPath}`);
 
     // Generate local URL
-    const localUrl = `${BACKEND_URL}/audio/chunks/${chunkFileName}`;
+    const localUrl = getChunkUrl(chunkFileName);
     logger.info(` Chunk URL: ${localUrl}`);
 
     return localUrl;
@@ -1,7 +1,7 @@
 import { getFirestore } from '../config/firebase.js';
 import { initializeLogger } from '../config/logger.js';
 import { generateSpeechWithTranslation } from './xttsService.js';
-import { downloadUserAudio, saveAudioToTemp, cleanupTempFile, uploadAudioChunk } from './audioManager.js';
+import { downloadUserAudio, saveAudioToTemp, cleanupTempFile, uploadAudioChunk, getChunkFileName, getChunkUrl } from './audioManager.js';
 import { splitTextIntoChunks, validateChunks, getChunkMetadata } from './textSplitter.js';
 import path from 'path';
 import fs from 'fs';
@@ -145,6 +145,14 @@ export async function processMessage(params) {
             logger.info(` [DEBUG]   - targetLanguage: ${targetLang}`);
             logger.info(` [DEBUG]   - voiceProfilePath: ${voiceProfilePath}`);
             
+            const chunkMetadata = {
+              messageId,
+              roomId,
+              languageCode: targetLang,
+              chunkIndex: chunkIdx,
+              totalChunks: chunks.length,
+            };
+
             let result;
             try {
               result = await generateSpeechWithTranslation({
@@ -152,6 +160,7 @@ export async function processMessage(params) {
                 sourceLanguage: sourceLanguage,
                 targetLanguage: targetLang,
                 referenceAudio: voiceProfilePath, //  Pass voice profile for voice cloning (not message audio)
+                storageKey: getChunkFileName(chunkMetadata), // Used when XTTS writes chunks itself
               });
               logger.info(` generateSpeechWithTranslation returned successfully with translatedText: "${result.translatedText}"`);
             } catch (innerError) {
@@ -169,14 +178,10 @@ export async function processMessage(params) {
             langTranslations.push(result.translatedText);
             logger.info(` Successfully pushed translation. Array now has ${langTranslations.length} items`);
 
-            // Upload audio chunk immediately
-            const audioUrl = await uploadAudioChunk(result.audioBuffer, {
-              messageId,
-              roomId,
-              languageCode: targetLang,
-              chunkIndex: chunkIdx,
-              totalChunks: chunks.length,
-            });
+            // Upload audio chunk immediately (XTTS may already have stored it)
+            const audioUrl = result.storedKey
+              ? getChunkUrl(result.storedKey)
+              : await uploadAudioChunk(result.audioBuffer, chunkMetadata);
 
             langAudioUrls.push(audioUrl);
             processedChunkCount++;
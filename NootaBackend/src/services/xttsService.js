@@ -13,6 +13,7 @@
  * - Option B: HF Token: Get valid token from huggingface.co and update .env
  */
 import axios from 'axios';
+import http from 'http';
 import { initializeLogger } from '../config/logger.js';
 import { generateSpeechMacOS } from './macosTtsService.js';
 
@@ -21,9 +22,19 @@ const isMacOS = process.platform === 'darwin';
 
 // XTTS Servers - Priority order
 const XTTS_LOCAL_URL = process.env.XTTS_LOCAL_SERVER || 'http://localhost:8000';
+// Same-host XTTS: reuse connections, and go over its Unix socket (XTTS_SOCKET
+// on the Python side) instead of loopback TCP when XTTS_LOCAL_SOCKET is set
+const XTTS_LOCAL_SOCKET = process.env.XTTS_LOCAL_SOCKET;
+const xttsLocalAgent = new http.Agent({ keepAlive: true });
+const XTTS_LOCAL_OPTIONS = XTTS_LOCAL_SOCKET
+  ? { httpAgent: xttsLocalAgent, socketPath: XTTS_LOCAL_SOCKET }
+  : { httpAgent: xttsLocalAgent };
 const XTTS_HF_SPACES = 'https://coqui-coqui-xtts.hf.space';  // Free HF Spaces endpoint
 const XTTS_API_URL = process.env.XTTS_SERVER_URL || 'https://router.huggingface.co/models/coqui/XTTS-v2';
 const HF_TOKEN = process.env.XTTS_HF_TOKEN;
+// When the local XTTS server shares our uploads/audio/chunks directory
+// (XTTS_STORAGE_DIR on the Python side) it writes chunk files itself
+const XTTS_DIRECT_STORAGE = process.env.XTTS_DIRECT_STORAGE === 'true';
 let USE_LOCAL_XTTS = false;
 let USE_HF_SPACES = false;
 
@@ -57,8 +68,10 @@ const LANGUAGE_MAP = {
 export async function initializeXTTS() {
   // Try local server first
   try {
-    const response = await axios.get(`${XTTS_LOCAL_URL}/health`, { timeout: 5000 });
-    logger.info(' Local XTTS server is running! Using local synthesis.');
+    const response = await axios.get(`${XTTS_LOCAL_URL}/health`, { ...XTTS_LOCAL_OPTIONS, timeout: 5000 });
+    // The server answers while the model is still loading in the background
+    const state = response.data?.startup?.state || response.data?.status;
+    logger.info(` Local XTTS server is running (${state})! Using local synthesis.`);
     USE_LOCAL_XTTS = true;
     return true;
   } catch (error) {
@@ -277,6 +290,7 @@ export async function generateSpeechWithTranslation(options) {
     sourceLanguage = 'en',
     targetLanguage = 'en',
     referenceAudio,
+    storageKey,
   } = options;
 
   if (!text) {
@@ -347,17 +361,56 @@ export async function generateSpeechWithTranslation(options) {
 
       const headers = formData.getHeaders();
 
-      logger.info(`🔊 Calling local XTTS server for ${mappedTargetLang}: "${translatedText.substring(0, 40)}..."`);
+      if (XTTS_DIRECT_STORAGE && storageKey) {
+        // XTTS writes the file into shared storage and only returns metadata
+        formData.append('storage_key', storageKey);
 
-      const response = await axios.post(`${XTTS_LOCAL_URL}/api/synthesize`, formData, {
-        headers,
-        responseType: 'arraybuffer',
-        timeout: 120000,
-      });
+        logger.info(`🔊 Calling local XTTS server for ${mappedTargetLang} (direct to storage: ${storageKey})`);
 
-      speechAudioBuffer = Buffer.from(response.data);
-      logger.info(`  Local XTTS generated speech successfully (${speechAudioBuffer.length} bytes)`);
+        const response = await axios.post(`${XTTS_LOCAL_URL}/api/synthesize`, formData, {
+          ...XTTS_LOCAL_OPTIONS,
+          headers,
+          responseType: 'arraybuffer',
+          timeout: 120000,
+        });
 
+        const body = Buffer.from(response.data);
+        const contentType = response.headers['content-type'] || '';
+        if (contentType.startsWith('application/json')) {
+          const result = JSON.parse(body.toString('utf8'));
+          if (result.storage_key !== storageKey) {
+            throw new Error(`Local XTTS did not store ${storageKey}: ${JSON.stringify(result).substring(0, 200)}`);
+          }
+
+          logger.info(`  Local XTTS stored ${storageKey} (${result.bytes} bytes)`);
+
+          return {
+            translatedText: translatedText,
+            audioBuffer: Buffer.alloc(0),
+            storedKey: result.storage_key,
+          };
+        }
+
+        // A server without direct-to-storage support ignores storage_key and
+        // answers with the audio itself; upload those bytes as usual
+        if (body.length === 0) {
+          throw new Error(`Local XTTS returned an empty response for ${storageKey}`);
+        }
+        logger.warn(` Local XTTS ignored storage_key (${contentType}), uploading the ${body.length} returned bytes`);
+        speechAudioBuffer = body;
+      } else {
+        logger.info(`🔊 Calling local XTTS server for ${mappedTargetLang}: "${translatedText.substring(0, 40)}..."`);
+
+        const response = await axios.post(`${XTTS_LOCAL_URL}/api/synthesize`, formData, {
+          ...XTTS_LOCAL_OPTIONS,
+          headers,
+          responseType: 'arraybuffer',
+          timeout: 120000,
+        });
+
+        speechAudioBuffer = Buffer.from(response.data);
+        logger.info(`  Local XTTS generated speech successfully (${speechAudioBuffer.length} bytes)`);
+      }
 
     } else if (USE_HF_SPACES) {
       // Use HF Spaces (free, no token needed)
@@ -52,17 +52,30 @@ cd "$BACKEND_DIR"
 ) &
 XTTS_SETUP_PID=$!
 
-# Wait for XTTS to start (max 120 seconds for model loading)
-echo -e "${YELLOW} Waiting for XTTS to initialize (this may take 1-2 minutes on first run)...${NC}"
+# Wait for XTTS to become ready. The server binds right away and loads the
+# model in the background, so /health/live tells "loading" apart from "dead"
+# and /health/ready turns 200 once synthesis requests can be served.
+echo -e "${YELLOW} Waiting for XTTS to initialize (this may take a few minutes on first run)...${NC}"
 XTTS_READY=false
-for i in {1..240}; do
-    if curl -s http://localhost:8000/health >/dev/null 2>&1; then
+XTTS_WAIT=${XTTS_WAIT:-600}
+for i in $(seq 1 $((XTTS_WAIT * 2))); do
+    if curl -sf http://localhost:8000/health/ready >/dev/null 2>&1; then
+        echo ""
         echo -e "${GREEN} XTTS Server is ready!${NC}"
         XTTS_READY=true
         break
     fi
-    if [ $i -eq 240 ]; then
-        echo -e "${RED}XTTS Server failed to start after 120 seconds${NC}"
+    LIVE_CODE=$(curl -s -o /dev/null -w "%{http_code}" http://localhost:8000/health/live 2>/dev/null || true)
+    if [ "$LIVE_CODE" = "503" ]; then
+        echo ""
+        echo -e "${RED}XTTS model failed to load${NC}"
+        curl -s http://localhost:8000/health/live
+        echo ""
+        echo "Check logs: $XTTS_LOG"
+        exit 1
+    fi
+    if [ $i -eq $((XTTS_WAIT * 2)) ]; then
+        echo -e "${RED}XTTS Server was not ready after ${XTTS_WAIT} seconds${NC}"
         echo "Check logs: $XTTS_LOG"
         if [ -f "$XTTS_LOG" ]; then
             echo "--- Last 50 lines of XTTS log ---"
@@ -70,9 +83,14 @@ for i in {1..240}; do
         fi
         exit 1
     fi
-    # Show progress
+    # Show the loading stage every 5 seconds
     if [ $((i % 10)) -eq 0 ]; then
-        echo -ne "."
+        if [ "$LIVE_CODE" = "200" ]; then
+            STATE=$(curl -s http://localhost:8000/health/live | python3 -c "import json,sys; s=json.load(sys.stdin); print(s['state'], s.get('progress'))" 2>/dev/null || true)
+            echo -e "  ${BLUE}XTTS: ${STATE}${NC}"
+        else
+            echo -ne "."
+        fi
     fi
     sleep 0.5
 done
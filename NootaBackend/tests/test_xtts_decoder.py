@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from xtts_decoder import CompiledDecoder
+
+LATENT_DIM = 8
+D_VECTOR_DIM = 4
+HOP = 4
+
+
+class Vocoder(torch.nn.Module):
+    """Small stand-in with the HiFi-GAN call signature: (B, T, C) latents -> (B, 1, T * HOP)"""
+
+    def __init__(self):
+        super().__init__()
+        self.pre = torch.nn.Conv1d(LATENT_DIM, 16, 3, padding=1)
+        self.cond = torch.nn.Conv1d(D_VECTOR_DIM, 16, 1)
+        self.up = torch.nn.ConvTranspose1d(16, 8, HOP * 2, stride=HOP, padding=HOP // 2)
+        self.post = torch.nn.Conv1d(8, 1, 7, padding=3)
+
+    def forward(self, latents, g):
+        x = self.pre(latents.transpose(1, 2)) + self.cond(g)
+        x = self.up(torch.nn.functional.leaky_relu(x, 0.1))
+        return torch.tanh(self.post(torch.nn.functional.leaky_relu(x, 0.1)))
+
+
+def test_bucketed_output_matches_eager_except_tail(tmp_path):
+    torch.manual_seed(0)
+    vocoder = Vocoder().eval()
+    decoder = CompiledDecoder(
+        vocoder, mode='trace', buckets=(16, 32), cache_dir=str(tmp_path),
+        latent_dim=LATENT_DIM, d_vector_dim=D_VECTOR_DIM, device='cpu', tag='test',
+    ).prepare()
+
+    latents = torch.randn(1, 21, LATENT_DIM)
+    g = torch.randn(1, D_VECTOR_DIM, 1)
+    with torch.inference_mode():
+        eager = vocoder(latents, g)
+        bucketed = decoder(latents, g)
+
+    assert decoder.hits == 1
+    assert bucketed.shape == eager.shape
+    # Only samples whose receptive field reaches the padded frames may differ
+    tail = 2 * HOP + 3
+    torch.testing.assert_close(bucketed[..., :-tail], eager[..., :-tail])
+    assert (bucketed[..., -tail:] - eager[..., -tail:]).abs().max() < 1.0
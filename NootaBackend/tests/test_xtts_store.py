@@ -0,0 +1,30 @@
+import os
+import json
+
+import pytest
+
+manage = pytest.importorskip('TTS.utils.manage')
+
+from xtts_store import REQUIRED_FILES, ModelStore
+
+
+def test_download_lands_in_model_dir(tmp_path, monkeypatch):
+    """Files written by the TTS model manager are where the store looks for them"""
+    def download_model(self, model_name):
+        # Same target as the real manager: <output_prefix>/<type--lang--dataset--model>
+        output_path = os.path.join(self.output_prefix, model_name.replace('/', '--'))
+        os.makedirs(output_path, exist_ok=True)
+        for name in REQUIRED_FILES:
+            with open(os.path.join(output_path, name), 'wb') as f:
+                f.write(name.encode())
+        return output_path, None, None
+
+    monkeypatch.setattr(manage.ModelManager, 'download_model', download_model)
+    monkeypatch.delenv('XTTS_MODEL_VERIFY', raising=False)
+
+    store = ModelStore(root=str(tmp_path), offline=False)
+    store.download()
+
+    assert store.verify(mode='full') == []
+    with open(store.manifest_path) as f:
+        assert sorted(json.load(f)['files']) == sorted(REQUIRED_FILES)
@@ -0,0 +1,452 @@
+"""
+In-memory audio encoding for the XTTS servers
+Turns an engine waveform into response bytes without touching the filesystem
+
+WAV is written directly; FLAC, Opus (in Ogg) and MP3 are encoded in-process
+with libsndfile (through soundfile) on a small dedicated thread pool.
+Output can be resampled (polyphase FIR) and WAV can carry float32 samples.
+
+Environment:
+  XTTS_ENCODER_THREADS  - encoder pool size (default: 2)
+  XTTS_OPUS_BITRATE     - Opus target bitrate in kbps (default: 24)
+  XTTS_MP3_BITRATE      - MP3 constant bitrate in kbps (default: 48)
+  XTTS_FLAC_LEVEL       - FLAC compression level 0-8 (default: 5)
+  XTTS_STORAGE_DIR      - shared directory for direct-to-storage output (default: off)
+"""
+
+import io
+import os
+import math
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import Response
+
+try:
+    import soundfile as sf
+except ImportError:
+    sf = None
+
+AudioFormat = namedtuple('AudioFormat', 'mimetype extension container subtype')
+
+# What a request asked for; sample_rate None keeps the model's native rate
+AudioOutput = namedtuple('AudioOutput', 'format sample_rate sample_format')
+AudioOutput.__new__.__defaults__ = ('wav', None, 'pcm16')
+
+SAMPLE_RATES = (8000, 16000, 22050, 24000)
+SAMPLE_FORMATS = ('pcm16', 'float32')
+
+# Opus itself only runs at these rates
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+FORMATS = {
+    'wav': AudioFormat('audio/wav', 'wav', None, None),
+    'opus': AudioFormat('audio/ogg', 'ogg', 'OGG', 'OPUS'),
+    'flac': AudioFormat('audio/flac', 'flac', 'FLAC', 'PCM_16'),
+    'mp3': AudioFormat('audio/mpeg', 'mp3', 'MP3', 'MPEG_LAYER_III'),
+}
+
+FORMAT_ALIASES = {
+    'ogg': 'opus',
+    'audio/wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+}
+
+# Offered to Accept negotiation in order of preference on ties; WAV stays
+# first so "*/*" and missing Accept headers keep today's responses
+NEGOTIABLE_MIMETYPES = ['audio/wav', 'audio/ogg', 'audio/opus', 'audio/flac', 'audio/mpeg', 'audio/mp3']
+
+# libsndfile maps its 0..1 compression level linearly onto these bitrate
+# ranges (kbps, per channel); MP3 below 32 kHz is MPEG-2 layer III
+OPUS_BITRATES = (6, 256)
+MP3_BITRATES = (32, 320)
+MP3_BITRATES_MPEG2 = (8, 160)
+
+
+def to_pcm16(wav):
+    """Peak-normalize a float waveform to int16, exactly like TTS's save_wav()"""
+    wav = np.asarray(wav)
+    wav_norm = wav * (32767 / max(0.01, np.max(np.abs(wav))))
+    return wav_norm.astype(np.int16)
+
+
+def wav_header(num_samples, sample_rate, channels=1, bits_per_sample=16, format_tag=WAVE_FORMAT_PCM):
+    """44-byte RIFF/WAVE header for a single data chunk"""
+    block_align = channels * bits_per_sample // 8
+    data_size = num_samples * block_align
+    return b''.join([
+        b'RIFF', struct.pack('<I', 36 + data_size), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHH', 16, format_tag, channels, sample_rate,
+                             sample_rate * block_align, block_align, bits_per_sample),
+        b'data', struct.pack('<I', data_size),
+    ])
+
+
+def encode_wav(wav, sample_rate, sample_format='pcm16'):
+    """WAV bytes for a float waveform; the pcm16 default is what TTS writes to disk"""
+    if sample_format == 'float32':
+        samples = np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0).astype('<f4', copy=False)
+        return wav_header(len(samples), sample_rate, bits_per_sample=32,
+                          format_tag=WAVE_FORMAT_IEEE_FLOAT) + samples.tobytes()
+    pcm = to_pcm16(wav).astype('<i2', copy=False)
+    return wav_header(len(pcm), sample_rate) + pcm.tobytes()
+
+
+def encode_raw(wav, sample_format='pcm16'):
+    """Headerless little-endian samples for streaming
+
+    Unlike to_pcm16() there is no peak normalization: a stream's later frames
+    are not known yet, so every frame uses the same fixed [-1, 1] scale.
+    """
+    samples = np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0)
+    if sample_format == 'float32':
+        return samples.astype('<f4', copy=False).tobytes()
+    return (samples * 32767).astype('<i2').tobytes()
+
+# ============================================================================
+# RESAMPLING
+# ============================================================================
+
+RESAMPLE_ZERO_CROSSINGS = 10
+RESAMPLE_KAISER_BETA = 8.0
+RESAMPLE_BLOCK = 1 << 15
+
+_filter_banks = {}
+
+
+def _filter_bank(up, down):
+    """Kaiser-windowed sinc low-pass split into `up` polyphase branches"""
+    key = (up, down)
+    if key not in _filter_banks:
+        factor = max(up, down)
+        half = RESAMPLE_ZERO_CROSSINGS * factor
+        k = np.arange(-half, half + 1)
+        h = np.sinc(k / factor) * np.kaiser(len(k), RESAMPLE_KAISER_BETA) * (up / factor)
+
+        # Branch p holds taps p, p + up, p + 2*up, ...
+        taps = math.ceil(len(h) / up)
+        h = np.pad(h, (0, taps * up - len(h)))
+        _filter_banks[key] = (h.reshape(taps, up).T.astype(np.float32), half)
+    return _filter_banks[key]
+
+
+def resample(wav, source_rate, target_rate):
+    """Rational-factor polyphase resampling, vectorized over blocks of output samples
+
+    Equivalent to upsampling by `up`, low-pass filtering and keeping every
+    `down`-th sample, but only the filter taps that land on real input
+    samples are ever multiplied.
+    """
+    wav = np.asarray(wav, dtype=np.float32)
+    if source_rate == target_rate:
+        return wav
+
+    g = math.gcd(source_rate, target_rate)
+    up, down = target_rate // g, source_rate // g
+    bank, delay = _filter_bank(up, down)
+    taps = bank.shape[1]
+
+    out_len = math.ceil(len(wav) * up / down)
+    padded = np.pad(wav, (taps, taps + delay // up + 2))
+    offsets = np.arange(taps)
+
+    out = np.empty(out_len, dtype=np.float32)
+    for start in range(0, out_len, RESAMPLE_BLOCK):
+        n = np.arange(start, min(start + RESAMPLE_BLOCK, out_len))
+        t = n * down + delay
+        phase, base = t % up, t // up
+        frames = padded[(base + taps)[:, None] - offsets[None, :]]
+        out[start:start + len(n)] = np.einsum('ij,ij->i', frames, bank[phase])
+    return out
+
+# ============================================================================
+# STITCHING
+# ============================================================================
+
+def trim_silence(wav, sample_rate, threshold_db=-40.0, keep_ms=60):
+    """Drop leading/trailing samples quieter than threshold_db below the peak
+
+    keep_ms of the original edge is kept on each side so word onsets and
+    releases are not clipped.
+    """
+    wav = np.asarray(wav, dtype=np.float32)
+    peak = np.max(np.abs(wav)) if len(wav) else 0.0
+    if peak == 0.0:
+        return wav
+    loud = np.flatnonzero(np.abs(wav) > peak * 10 ** (threshold_db / 20))
+    keep = int(sample_rate * keep_ms / 1000)
+    return wav[max(0, loud[0] - keep):loud[-1] + 1 + keep]
+
+
+def stitch(wavs, sample_rate, crossfade_ms=20, trim=True):
+    """Join waveforms with linear crossfades; returns (wav, [(start_s, end_s), ...])
+
+    Offsets are where each chunk starts and ends in the joined audio.
+    """
+    if trim:
+        wavs = [trim_silence(w, sample_rate) for w in wavs]
+    else:
+        wavs = [np.asarray(w, dtype=np.float32) for w in wavs]
+
+    fade = int(sample_rate * crossfade_ms / 1000)
+    out = np.zeros(sum(len(w) for w in wavs), dtype=np.float32)
+
+    offsets = []
+    position = 0
+    for i, w in enumerate(wavs):
+        overlap = min(fade, len(w), position) if i else 0
+        start = position - overlap
+        if overlap:
+            ramp = np.linspace(0.0, 1.0, overlap, endpoint=False, dtype=np.float32)
+            out[start:position] = out[start:position] * (1.0 - ramp) + w[:overlap] * ramp
+        end = start + len(w)
+        out[position:end] = w[overlap:]
+        offsets.append((start / sample_rate, end / sample_rate))
+        position = end
+
+    return out[:position], offsets
+
+# ============================================================================
+# DIRECT-TO-STORAGE OUTPUT
+# ============================================================================
+
+def storage_path(root, key):
+    """Absolute path for a storage key, refusing keys that escape root"""
+    key = str(key).replace('\\', '/').lstrip('/')
+    parts = [p for p in key.split('/') if p not in ('', '.')]
+    if not parts or '..' in parts:
+        raise ValueError(f"Invalid storage key: {key}")
+
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, *parts))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Invalid storage key: {key}")
+    return path
+
+
+def check_storage_extension(key, fmt):
+    """Refuse a storage key whose file extension names a different format than fmt"""
+    extension = os.path.splitext(str(key))[1].lstrip('.').lower()
+    if not extension:
+        return
+    if FORMAT_ALIASES.get(extension, extension) != fmt:
+        raise ValueError(
+            f"storage_key extension .{extension} does not match the {fmt} output "
+            f"(use .{FORMATS[fmt].extension})"
+        )
+
+
+def store_audio(root, key, data):
+    """Write encoded audio under root/key atomically; returns the final path
+
+    Readers either see the previous file or the complete new one - the bytes
+    go to a temporary file in the same directory which is then renamed over
+    the target.
+    """
+    path = storage_path(root, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+# ============================================================================
+# COMPRESSED FORMATS
+# ============================================================================
+
+def resolve_format(value):
+    """'ogg' / 'audio/mpeg' / 'FLAC' -> canonical format name"""
+    name = str(value).strip().lower()
+    name = FORMAT_ALIASES.get(name, name)
+    if name not in FORMATS:
+        raise ValueError(f"Unsupported audio format: {value} (use one of {', '.join(FORMATS)})")
+    return name
+
+
+def negotiate_format(request, data=None):
+    """Explicit `format` field or query parameter wins, then the Accept header, then WAV"""
+    value = (data or {}).get('format') or request.args.get('format')
+    if value:
+        return resolve_format(value)
+    best = request.accept_mimetypes.best_match(NEGOTIABLE_MIMETYPES, default='audio/wav')
+    return FORMAT_ALIASES[best]
+
+
+def resolve_output(data, fmt=None):
+    """AudioOutput from `format`, `sample_rate` and `sample_format` request fields"""
+    fmt = fmt or resolve_format(data.get('format') or 'wav')
+
+    sample_rate = data.get('sample_rate')
+    if sample_rate not in (None, ''):
+        try:
+            sample_rate = int(float(sample_rate))
+        except (TypeError, ValueError):
+            sample_rate = None
+        if sample_rate not in SAMPLE_RATES:
+            raise ValueError(f"Unsupported sample_rate: {data.get('sample_rate')} "
+                             f"(use one of {', '.join(map(str, SAMPLE_RATES))})")
+    else:
+        sample_rate = None
+
+    sample_format = str(data.get('sample_format') or 'pcm16').lower()
+    if sample_format not in SAMPLE_FORMATS:
+        raise ValueError(f"Unsupported sample_format: {sample_format} (use pcm16 or float32)")
+    if sample_format == 'float32' and fmt != 'wav':
+        raise ValueError("sample_format float32 is only available for wav output")
+    if fmt == 'opus' and sample_rate and sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"Opus cannot be encoded at {sample_rate} Hz")
+
+    return AudioOutput(fmt, sample_rate, sample_format)
+
+
+def negotiate_output(request, data=None):
+    """resolve_output() for a request, with the format negotiated as in negotiate_format()"""
+    fields = {**request.args.to_dict(), **(data or {})}
+    return resolve_output(fields, negotiate_format(request, data))
+
+
+def available_formats():
+    """Formats this process can actually encode (depends on the libsndfile build)"""
+    if sf is None:
+        return ['wav']
+    containers = sf.available_formats()
+    return [name for name, spec in FORMATS.items()
+            if spec.container is None or spec.container in containers]
+
+
+def _bitrate_level(kbps, bitrates):
+    low, high = bitrates
+    return min(1.0, max(0.0, (high - kbps) / (high - low)))
+
+
+def encoder_options(fmt, sample_rate):
+    """soundfile keyword arguments implementing the per-format bitrate settings"""
+    if fmt == 'opus':
+        kbps = float(os.getenv('XTTS_OPUS_BITRATE', 24))
+        return {'compression_level': _bitrate_level(kbps, OPUS_BITRATES)}
+    if fmt == 'mp3':
+        kbps = float(os.getenv('XTTS_MP3_BITRATE', 48))
+        bitrates = MP3_BITRATES if sample_rate >= 32000 else MP3_BITRATES_MPEG2
+        return {'compression_level': _bitrate_level(kbps, bitrates), 'bitrate_mode': 'CONSTANT'}
+    if fmt == 'flac':
+        return {'compression_level': min(8, max(0, int(os.getenv('XTTS_FLAC_LEVEL', 5)))) / 8}
+    return {}
+
+
+def encode_audio(wav, sample_rate, output=AudioOutput()):
+    """Encode a float waveform as requested; every format starts from the same samples
+
+    Returns (bytes, sample rate of the encoded audio).
+    """
+    if output.sample_rate and output.sample_rate != sample_rate:
+        wav = resample(wav, sample_rate, output.sample_rate)
+        sample_rate = output.sample_rate
+
+    fmt = output.format
+    if fmt == 'wav':
+        return encode_wav(wav, sample_rate, output.sample_format), sample_rate
+    if sf is None:
+        raise ValueError(f"Encoding {fmt} needs the soundfile package")
+
+    spec = FORMATS[fmt]
+    buffer = io.BytesIO()
+    with sf.SoundFile(buffer, 'w', samplerate=sample_rate, channels=1,
+                      format=spec.container, subtype=spec.subtype,
+                      **encoder_options(fmt, sample_rate)) as f:
+        f.write(to_pcm16(wav))
+    return buffer.getvalue(), sample_rate
+
+
+class AudioEncoder:
+    """Encodes responses on a dedicated thread pool and keeps per-format timings
+
+    Synthesis releases the engine as soon as the waveform exists; encoding
+    then runs here, so a batch can encode one language while the GPT is
+    already generating the next.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or int(os.getenv('XTTS_ENCODER_THREADS', 2))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                        thread_name_prefix='xtts-encoder')
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def submit(self, wav, sample_rate, output=AudioOutput()):
+        """Future resolving to (bytes, encode seconds, output sample rate)"""
+        return self._pool.submit(self._encode, wav, sample_rate, output)
+
+    def encode(self, wav, sample_rate, output=AudioOutput()):
+        return self.submit(wav, sample_rate, output).result()
+
+    def _encode(self, wav, sample_rate, output):
+        start = time.perf_counter()
+        data, output_rate = encode_audio(wav, sample_rate, output)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            stats = self._stats.setdefault(output.format, {
+                'requests': 0, 'audio_seconds': 0.0, 'bytes': 0, 'encode_seconds': 0.0
+            })
+            stats['requests'] += 1
+            stats['audio_seconds'] += len(wav) / sample_rate
+            stats['bytes'] += len(data)
+            stats['encode_seconds'] += elapsed
+        return data, elapsed, output_rate
+
+    def response(self, wav, sample_rate, output=AudioOutput(), download_name='output.wav'):
+        """Flask response carrying the encoded waveform as an attachment"""
+        data, elapsed, output_rate = self.encode(wav, sample_rate, output)
+        spec = FORMATS[output.format]
+        download_name = f"{os.path.splitext(download_name)[0]}.{spec.extension}"
+        return Response(
+            data,
+            mimetype=spec.mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename={download_name}',
+                'X-Audio-Format': output.format,
+                'X-Sample-Rate': str(output_rate),
+                'X-Encode-Time-Ms': f'{elapsed * 1000:.1f}',
+                'Vary': 'Accept',
+            },
+        )
+
+    def info(self):
+        with self._lock:
+            formats = {
+                fmt: {
+                    **stats,
+                    'kbps': round(stats['bytes'] * 8 / 1000 / stats['audio_seconds'], 1)
+                    if stats['audio_seconds'] else 0.0,
+                    'avg_encode_ms': round(stats['encode_seconds'] * 1000 / stats['requests'], 2),
+                }
+                for fmt, stats in self._stats.items()
+            }
+        return {
+            'threads': self.max_workers,
+            'available_formats': available_formats(),
+            'formats': formats,
+        }
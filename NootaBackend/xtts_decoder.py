@@ -0,0 +1,202 @@
+"""
+Compiled HiFi-GAN decoder for the XTTS v2 engine
+
+The vocoder is traced (TorchScript) or compiled (torch.compile) once per
+latent-length bucket. GPT latents are padded up to the nearest bucket and
+the waveform is trimmed back, so a handful of graphs cover every request.
+Latents longer than the largest bucket run the eager module.
+
+Padding repeats the last latent frame, and the vocoder's convolutions see
+those frames near the end of the kept audio, so the final few milliseconds
+differ slightly from the eager decoder (length and everything before the
+tail are the same; tests/test_xtts_decoder.py checks this).
+
+Environment:
+  XTTS_DECODER_COMPILE  - off | trace | compile (default: off)
+  XTTS_DECODER_BUCKETS  - comma separated latent frame counts
+  XTTS_COMPILE_CACHE    - directory for persisted graphs / inductor cache
+"""
+
+import os
+import hashlib
+import logging
+import contextlib
+
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+DECODER_MODES = ('off', 'trace', 'compile')
+
+DEFAULT_BUCKETS = (32, 64, 128, 256, 384, 512)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'xtts_compile'
+)
+
+
+def parse_buckets(value):
+    """'32,64,128' -> (32, 64, 128)"""
+    if not value:
+        return DEFAULT_BUCKETS
+    return tuple(sorted({int(v) for v in value.split(',') if v.strip()}))
+
+
+class CompiledDecoder:
+    """Dispatches HiFi-GAN calls to per-bucket compiled graphs, eager otherwise"""
+
+    def __init__(self, decoder, mode, buckets, cache_dir, latent_dim, d_vector_dim,
+                 device, tag, autocast=None):
+        self.decoder = decoder
+        self.mode = mode
+        self.buckets = tuple(sorted(buckets))
+        self.cache_dir = os.path.join(cache_dir, tag)
+        self.latent_dim = latent_dim
+        self.d_vector_dim = d_vector_dim
+        self.device = device
+        # The engine's autocast context; warmup runs under it like serving does
+        self.autocast = autocast or contextlib.nullcontext
+
+        self._graphs = {}
+        self.hits = 0
+        self.fallbacks = 0
+
+    def prepare(self):
+        """Load persisted graphs or build missing ones for every bucket"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        if self.mode == 'compile':
+            # Inductor persists generated kernels here, so only the first
+            # start of a deployment pays the compile time
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(self.cache_dir, 'inductor'))
+            try:
+                import torch._inductor.config as inductor_config
+                inductor_config.fx_graph_cache = True
+            except (ImportError, AttributeError):
+                pass
+            compiled = torch.compile(self.decoder, dynamic=False)
+
+        for frames in self.buckets:
+            latents = torch.zeros(1, frames, self.latent_dim, device=self.device)
+            g = torch.zeros(1, self.d_vector_dim, 1, device=self.device)
+            try:
+                graph = self._load_or_trace(frames, latents, g) if self.mode == 'trace' else compiled
+                # Same call path, inference mode and autocast state as requests
+                # (inference tensors included, torch.compile guards on them),
+                # so the first real request neither recompiles nor re-profiles
+                with torch.inference_mode(), self.autocast():
+                    self._run(graph, latents.clone(), g.clone())
+                self._graphs[frames] = graph
+            except Exception as e:
+                logger.warning(f"Decoder {self.mode} failed for {frames} frames, using eager: {e}")
+
+        logger.info(f" Decoder graphs ready ({self.mode}): {sorted(self._graphs)}")
+        return self
+
+    def _load_or_trace(self, frames, latents, g):
+        path = os.path.join(self.cache_dir, f'hifigan_{frames}.pt')
+        if os.path.exists(path):
+            try:
+                return torch.jit.load(path, map_location=self.device)
+            except Exception as e:
+                logger.warning(f"Discarding unreadable decoder graph {path}: {e}")
+
+        with torch.no_grad():
+            traced = torch.jit.trace(self.decoder, (latents, g), check_trace=False)
+        traced = torch.jit.freeze(traced.eval())
+
+        # Write then rename so a crash mid-save never leaves a truncated graph
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        torch.jit.save(traced, tmp_path)
+        os.replace(tmp_path, path)
+        return traced
+
+    def info(self):
+        return {
+            'mode': self.mode,
+            'buckets': list(self.buckets),
+            'compiled_buckets': sorted(self._graphs),
+            'cache_dir': self.cache_dir,
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+        }
+
+    def __call__(self, latents, g):
+        frames = latents.shape[1]
+        bucket = next((b for b in self.buckets if b >= frames), None)
+        graph = self._graphs.get(bucket)
+        if graph is None:
+            self.fallbacks += 1
+            return self.decoder(latents, g=g)
+
+        self.hits += 1
+        padded = latents
+        if bucket != frames:
+            # Edge replication rather than zeros keeps the tail close to eager
+            # (see the module docstring); the output is cut back to frames
+            padded = F.pad(
+                latents.transpose(1, 2), (0, bucket - frames), mode='replicate'
+            ).transpose(1, 2)
+
+        wav = self._run(graph, padded, g)
+        keep = wav.shape[-1] * frames // bucket
+        return wav[..., :keep]
+
+    def _run(self, graph, latents, g):
+        # Graphs are specialized on strides; padding and speed changes hand in
+        # transposed views
+        latents, g = latents.contiguous(), g.contiguous()
+        # Traced graphs are fp32 only; torch.compile handles autocast itself
+        context = contextlib.nullcontext()
+        if self.mode == 'trace':
+            context = torch.autocast(self.device.split(':')[0], enabled=False)
+            latents, g = latents.float(), g.float()
+
+        with context:
+            return graph(latents, g)
+
+
+def weights_digest(module):
+    """Short SHA-256 of a module's parameters and buffers"""
+    digest = hashlib.sha256()
+    for name, tensor in sorted(module.state_dict().items()):
+        digest.update(f'{name}:{tensor.dtype}:{tuple(tensor.shape)}'.encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def build_decoder(model, device, precision, mode=None, model_name=None, autocast=None):
+    """Return a CompiledDecoder for the model, or None when compilation is off
+
+    autocast is the zero-argument context factory the engine decodes under.
+    """
+    mode = (mode or os.getenv('XTTS_DECODER_COMPILE', 'off')).lower()
+    if mode not in DECODER_MODES:
+        logger.warning(f"Unknown XTTS_DECODER_COMPILE '{mode}', using eager decoder")
+        return None
+    if mode == 'off':
+        return None
+
+    buckets = parse_buckets(os.getenv('XTTS_DECODER_BUCKETS'))
+    cache_dir = os.getenv('XTTS_COMPILE_CACHE', DEFAULT_CACHE_DIR)
+
+    # Graphs are only valid for the torch build / device / precision that produced
+    # them, and frozen graphs embed the vocoder weights, so the tag also names the
+    # model and the exact weights (a new checkpoint or a swapped model re-traces)
+    model_tag = (model_name or 'xtts').replace('/', '--')
+    tag = (f"{model_tag}-{weights_digest(model.hifigan_decoder)}-"
+           f"torch-{torch.__version__.replace('+', '_')}-{device.replace(':', '')}-{precision}-{mode}")
+
+    decoder = CompiledDecoder(
+        model.hifigan_decoder.eval(),
+        mode=mode,
+        buckets=buckets,
+        cache_dir=cache_dir,
+        latent_dim=model.args.gpt_n_model_channels,
+        d_vector_dim=model.args.d_vector_dim,
+        device=device,
+        tag=tag,
+        autocast=autocast,
+    )
+    return decoder.prepare()
@@ -0,0 +1,1064 @@
+"""
+Noota XTTS v2 Engine
+Loads the XTTS v2 model once and runs synthesis through explicit
+GPT / decoder stages so the servers can tune each stage independently.
+
+Environment:
+  XTTS_BACKEND          - torch | onnx (default: torch, see xtts_onnx.py)
+  XTTS_DEVICE           - cuda | cpu (default: cuda when available)
+  XTTS_PRECISION        - fp32 | bf16 | auto (default: fp32, CPU only)
+  XTTS_DEFAULT_SPEAKER  - built-in speaker used when no reference audio is sent
+  XTTS_DECODER_COMPILE  - off | trace | compile (see xtts_decoder.py)
+  XTTS_PREFIX_CACHE     - voices whose GPT prefix KV-cache is kept (default: 8, 0 = off)
+  XTTS_LENGTH_MARGIN    - audio-token budget = expected tokens x margin (default: 2.0, 0 = off)
+  XTTS_SEGMENT_AUDIO_TOKENS - expected audio tokens a text segment may need (default: 400)
+  XTTS_TEXT_CACHE       - memoized (text, language) normalizations/tokenizations and segmentations (default: 4096, 0 = off)
+  XTTS_FFMPEG           - ffmpeg binary used for compressed reference audio (default: ffmpeg on PATH)
+  XTTS_VOICES           - registered voices (conditioning latents) kept in memory (default: 64)
+  XTTS_MODEL_DIR / XTTS_OFFLINE / XTTS_MODEL_VERIFY - persistent model store (see xtts_store.py)
+  XTTS_SNAPSHOT         - memory-mapped model snapshot to load instead of building (see xtts_snapshot.py)
+  XTTS_WARMUP           - 0 to skip the warmup pass before reporting ready (default: 1)
+  XTTS_WARMUP_LANGUAGES - languages synthesized during warmup (default: en)
+  XTTS_WARMUP_LENGTHS   - clauses per warmup text, one run per length bucket (default: 1,4)
+"""
+
+import gc
+import io
+import os
+import sys
+import math
+import time
+import hashlib
+import shutil
+import logging
+import platform
+import threading
+import subprocess
+import contextlib
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+import torchaudio
+
+from xtts_decoder import build_decoder
+from xtts_metrics import metrics, record_synthesis
+from xtts_store import ModelStore
+from xtts_text import segment_text
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+
+PRECISIONS = ('fp32', 'bf16', 'auto')
+
+# XTTS computes conditioning latents from 22.05 kHz reference audio
+REFERENCE_SAMPLE_RATE = 22050
+
+# Startup stages reported on /health, in order ('failed' can follow any of them)
+LOAD_STATES = ('starting', 'downloading', 'loading', 'warming', 'ready')
+
+# One clause per language; warmup texts repeat it to fill each length bucket
+WARMUP_PHRASES = {
+    'en': "the weather is lovely today",
+    'ar': "الطقس جميل اليوم",
+    'tr': "bugün hava çok güzel",
+    'es': "hoy hace muy buen tiempo",
+    'fr': "il fait très beau aujourd'hui",
+    'de': "das Wetter ist heute schön",
+    'it': "oggi il tempo è bellissimo",
+    'pt': "o tempo está ótimo hoje",
+    'zh-cn': "今天天气很好",
+    'ja': "今日はとても良い天気です",
+    'ko': "오늘 날씨가 정말 좋네요",
+}
+
+# ============================================================================
+# CPU CAPABILITY DETECTION
+# ============================================================================
+
+def _read_cpu_flags():
+    """Return (model name, set of feature flags) for the host CPU"""
+    model = platform.processor() or platform.machine()
+    flags = set()
+
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/cpuinfo') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    key = key.strip()
+                    if key == 'model name':
+                        model = value.strip()
+                    elif key in ('flags', 'Features'):
+                        flags.update(value.split())
+                        break
+        except OSError:
+            pass
+
+    elif sys.platform == 'darwin':
+        def sysctl(name):
+            try:
+                return subprocess.run(
+                    ['sysctl', '-n', name], capture_output=True, text=True, timeout=2
+                ).stdout.strip()
+            except (OSError, subprocess.SubprocessError):
+                return ''
+
+        model = sysctl('machdep.cpu.brand_string') or model
+        if sysctl('hw.optional.arm.FEAT_BF16') == '1':
+            flags.add('bf16')
+        flags.update(sysctl('machdep.cpu.leaf7_features').lower().split())
+
+    return model, flags
+
+
+def _torch_bf16_supported():
+    """Whether this torch build has fast bf16 CPU kernels (oneDNN)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def detect_cpu_capabilities():
+    """Detect CPU features relevant to reduced-precision inference"""
+    model, flags = _read_cpu_flags()
+
+    capabilities = {
+        'model': model,
+        'arch': platform.machine(),
+        'cores': os.cpu_count(),
+        'avx2': 'avx2' in flags,
+        'avx512f': 'avx512f' in flags,
+        'avx512_bf16': 'avx512_bf16' in flags,
+        'amx_bf16': 'amx_bf16' in flags,
+        'arm_bf16': 'bf16' in flags,
+        'torch_bf16': _torch_bf16_supported(),
+    }
+
+    x86_bf16 = capabilities['avx512_bf16'] or capabilities['amx_bf16']
+    capabilities['bf16_native'] = (
+        (x86_bf16 and capabilities['torch_bf16']) or capabilities['arm_bf16']
+    )
+    return capabilities
+
+
+def resolve_precision(requested, device, capabilities):
+    """Pick the precision to run with, falling back to fp32 when bf16 is unsupported"""
+    if requested not in PRECISIONS:
+        logger.warning(f"Unknown XTTS_PRECISION '{requested}', using fp32")
+        return 'fp32'
+
+    if device != 'cpu' or requested == 'fp32':
+        return 'fp32'
+
+    if capabilities['bf16_native']:
+        return 'bf16'
+
+    if requested == 'bf16':
+        logger.warning("bf16 requested but CPU has no native bf16 support, using fp32")
+    return 'fp32'
+
+# ============================================================================
+# REFERENCE AUDIO
+# ============================================================================
+
+# Containers torchaudio reads natively; anything else goes through ffmpeg
+PCM_SIGNATURES = (b'RIFF', b'fLaC')
+
+FFMPEG_TIMEOUT = 30
+
+
+def is_pcm_container(data):
+    return data[:4] in PCM_SIGNATURES
+
+
+def decode_compressed(data, sample_rate):
+    """Decode any ffmpeg-readable clip (AAC/M4A, Opus, MP3, ...) to a mono float [1, T] tensor
+
+    The bytes never touch the disk: they are handed to ffmpeg through an
+    in-memory file and the PCM comes back on stdout already downmixed and
+    resampled to sample_rate.
+    """
+    ffmpeg = os.getenv('XTTS_FFMPEG') or shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise ValueError("Compressed reference audio needs ffmpeg (not found on PATH)")
+
+    command = [ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error']
+    fd = None
+    if hasattr(os, 'memfd_create'):
+        # iOS M4A files keep their index (moov atom) after the audio, which
+        # ffmpeg can only reach on seekable input - a memfd is seekable and
+        # lives in RAM. Elsewhere fall back to a plain pipe.
+        fd = os.memfd_create('xtts-reference')
+        with os.fdopen(fd, 'wb', closefd=False) as f:
+            f.write(data)
+        command += ['-i', f'/proc/self/fd/{fd}']
+    else:
+        command += ['-i', 'pipe:0']
+    command += ['-vn', '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1']
+
+    try:
+        result = subprocess.run(
+            command,
+            input=None if fd is not None else bytes(data),
+            stdin=subprocess.DEVNULL if fd is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(fd,) if fd is not None else (),
+            timeout=FFMPEG_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        raise ValueError("Timed out decoding reference audio")
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+    if result.returncode != 0 or not result.stdout:
+        error = result.stderr.decode(errors='replace').strip().splitlines()
+        raise ValueError(f"Could not decode reference audio: {error[-1] if error else 'no audio stream'}")
+
+    return torch.frombuffer(bytearray(result.stdout), dtype=torch.float32).unsqueeze(0)
+
+# ============================================================================
+# CACHES
+# ============================================================================
+
+def voice_key(gpt_cond_latent):
+    """Stable identity of a voice derived from its GPT conditioning latents"""
+    data = gpt_cond_latent.detach().float().cpu().contiguous().numpy().tobytes()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _freeze_past(past):
+    """(legacy tuples, Cache class or None) for attention state kept in the prefix cache
+
+    Newer transformers return Cache objects that the next forward pass
+    extends in place, which would write every request's text and audio into
+    the shared entry. Only the immutable nested tuples are kept.
+    """
+    if hasattr(past, 'to_legacy_cache'):
+        return past.to_legacy_cache(), type(past)
+    return past, None
+
+
+def _thaw_past(frozen):
+    """Attention state for one forward pass, never aliasing the cached entry"""
+    past, cache_class = frozen
+    # from_legacy_cache() builds a new Cache whose updates concatenate into new tensors
+    return cache_class.from_legacy_cache(past) if cache_class is not None else past
+
+
+class LRUCache:
+    """Thread-safe bounded LRU with hit/miss counters"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = compute()
+        with self._lock:
+            self.misses += 1
+        self.put(key, value)
+        return value
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            'entries': size,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else None,
+        }
+
+# ============================================================================
+# GENERATION LENGTH BUDGET
+# ============================================================================
+
+# GPT audio tokens (~21.5 per second of speech) produced per input character
+# by XTTS v2 at default settings. Used until enough generations for a language
+# have been observed; scripts that pack a syllable or more into one character
+# (zh, ja, ko) need several tokens per character.
+AUDIO_TOKENS_PER_CHAR = {
+    'en': 1.45, 'es': 1.35, 'fr': 1.4, 'de': 1.4, 'it': 1.35, 'pt': 1.4,
+    'pl': 1.45, 'tr': 1.4, 'ru': 1.5, 'nl': 1.4, 'cs': 1.5, 'hu': 1.5,
+    'ar': 1.8, 'hi': 1.7, 'zh': 4.5, 'ja': 3.2, 'ko': 3.0,
+}
+DEFAULT_TOKENS_PER_CHAR = 1.6
+
+
+class GenerationBudget:
+    """Per-request cap on GPT audio tokens derived from text length and language
+
+    Each language starts from the prior in AUDIO_TOKENS_PER_CHAR and switches
+    to the tokens-per-character rate measured on this server once enough
+    generations have stopped on their own.
+    """
+
+    def __init__(self, max_tokens, margin=2.0, min_tokens=48, min_samples=20):
+        self.max_tokens = max_tokens
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.min_samples = min_samples
+        self._observed = {}  # lang -> [samples, mean tokens per char]
+        self._lock = threading.Lock()
+        self.triggered = 0
+
+    def rate(self, lang):
+        with self._lock:
+            samples, mean = self._observed.get(lang, (0, None))
+        if samples >= self.min_samples:
+            return mean
+        return AUDIO_TOKENS_PER_CHAR.get(lang, DEFAULT_TOKENS_PER_CHAR)
+
+    def tokens_for(self, text, lang):
+        expected = len(text.strip()) * self.rate(lang)
+        budget = math.ceil(expected * self.margin)
+        return min(self.max_tokens, max(self.min_tokens, budget))
+
+    def observe(self, text, lang, tokens, truncated):
+        """Record a finished generation; truncated ones say nothing about the true rate"""
+        if truncated:
+            with self._lock:
+                self.triggered += 1
+            return
+
+        chars = len(text.strip())
+        if not chars:
+            return
+        with self._lock:
+            samples, mean = self._observed.get(lang, (0, 0.0))
+            samples += 1
+            # Cumulative mean at first, then a slow moving average
+            weight = max(1.0 / samples, 0.02)
+            mean += (tokens / chars - mean) * weight
+            self._observed[lang] = [samples, mean]
+
+    def info(self):
+        with self._lock:
+            observed = {
+                lang: {'samples': samples, 'tokens_per_char': round(mean, 3)}
+                for lang, (samples, mean) in self._observed.items()
+            }
+        return {
+            'margin': self.margin,
+            'max_tokens': self.max_tokens,
+            'triggered': self.triggered,
+            'observed': observed,
+        }
+
+# ============================================================================
+# MODEL FILES
+# ============================================================================
+
+def _directory_size(path):
+    """Total size in bytes of the files under path (0 if it does not exist)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+class XTTSEngine:
+    """XTTS v2 model wrapper shared by the HTTP servers"""
+
+    backend = 'torch'
+
+    def __init__(self, model_name=MODEL_NAME, device=None, precision=None):
+        self.model_name = model_name
+        self.device = device or os.getenv('XTTS_DEVICE') or (
+            "cuda" if torch.cuda.is_available() else "cpu"
+        )
+        self.requested_precision = (precision or os.getenv('XTTS_PRECISION', 'fp32')).lower()
+        self.cpu_capabilities = detect_cpu_capabilities()
+        self.precision = resolve_precision(
+            self.requested_precision, self.device, self.cpu_capabilities
+        )
+        self.precision_fallback = None
+
+        self.store = ModelStore(model_name).configure()
+        self.model = None
+        self.config = None
+        self.decoder = None
+        self.sample_rate = 24000
+        self.snapshot_dir = os.getenv('XTTS_SNAPSHOT')
+        self.model_source = None
+        self.warmup = None
+
+        # The conditioning latents always come first in the GPT input, so their
+        # attention keys/values do not depend on the text and can be reused by
+        # every request for the same voice
+        prefix_cache_size = int(os.getenv('XTTS_PREFIX_CACHE', 8))
+        self.prefix_cache = LRUCache(prefix_cache_size) if prefix_cache_size > 0 else None
+
+        # Text cleaning (numbers, abbreviations, transliteration) and BPE are
+        # pure functions of (text, language); retries and repeated messages hit
+        # the same segments over and over
+        text_cache_size = int(os.getenv('XTTS_TEXT_CACHE', 4096))
+        self.text_cache = LRUCache(text_cache_size) if text_cache_size > 0 else None
+
+        # Voices registered ahead of time (gRPC RegisterVoice) are conditioned
+        # once and then referenced by id
+        self.voices = LRUCache(int(os.getenv('XTTS_VOICES', 64)))
+        self.length_margin = float(os.getenv('XTTS_LENGTH_MARGIN', 2.0))
+        self.budget = None
+        self.segment_audio_tokens = int(os.getenv('XTTS_SEGMENT_AUDIO_TOKENS', 400))
+
+        # XTTS keeps per-request state on the GPT module (cached prefix embedding),
+        # so synthesis on one model instance must be serialized
+        self._lock = threading.Lock()
+
+        self.state = 'starting'
+        self.state_details = {}
+        self.load_error = None
+        self.created = time.monotonic()
+        self.state_since = self.created
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def _set_state(self, state, **details):
+        self.state = state
+        self.state_details = details
+        self.state_since = time.monotonic()
+        logger.info(f" XTTS startup: {state} ({self.state_since - self.created:.1f}s)")
+
+    def load_status(self):
+        """Startup stage, progress and timings for the health endpoints"""
+        now = time.monotonic()
+        status = {
+            'state': self.state,
+            'progress': round(LOAD_STATES.index(self.state) / (len(LOAD_STATES) - 1), 2)
+                        if self.state in LOAD_STATES else None,
+            'stage_seconds': round(now - self.state_since, 1),
+            'uptime_seconds': round(now - self.created, 1),
+            **self.state_details,
+        }
+        if self.load_error:
+            status['error'] = self.load_error
+        return status
+
+    def load(self):
+        """Download (first run) and load the XTTS v2 checkpoint, then build the stages"""
+        try:
+            if not self._load_snapshot():
+                self._set_state('downloading')
+                self._download_model()
+                self._set_state('loading')
+                self._load_model()
+            self._set_state('warming')
+            self._prepare_stages()
+            self._warmup()
+        except Exception as e:
+            self.load_error = str(e)
+            self._set_state('failed')
+            raise
+        self._set_state('ready', warmup_seconds=self.warmup['seconds'] if self.warmup else None)
+        return self
+
+    def load_in_background(self):
+        """Run load() on a daemon thread so the server can bind right away"""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Failed to load XTTS model: {e}")
+
+        thread = threading.Thread(target=run, name='xtts-loader', daemon=True)
+        thread.start()
+        return thread
+
+    def unload(self):
+        """Drop the model and caches so their memory can be reclaimed (after a hot swap)"""
+        with self._lock:
+            self.model = self.config = self.decoder = None
+            for cache in (self.prefix_cache, self.text_cache, self.voices):
+                if cache is not None:
+                    cache.clear()
+        self._set_state('unloaded')
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def adopt_voices(self, other):
+        """Take over the voices registered on another engine with the same checkpoint"""
+        if other.model_name != self.model_name:
+            logger.info(f" Not adopting voices from {other.model_name}, re-register them")
+            return 0
+        voices = other.voices.items()
+        for key, latents in voices:
+            self.voices.put(key, latents)
+        return len(voices)
+
+    def _download_model(self):
+        """Make sure the model store holds a usable copy, downloading it unless offline"""
+        done = threading.Event()
+
+        def watch():
+            # The TTS model manager has no progress callback, so report what is on disk
+            while not done.wait(1.0):
+                self.state_details['downloaded_bytes'] = _directory_size(self.store.model_dir)
+
+        threading.Thread(target=watch, name='xtts-download-progress', daemon=True).start()
+        try:
+            self.store.ensure()
+        finally:
+            done.set()
+        self.state_details['downloaded_bytes'] = _directory_size(self.store.model_dir)
+
+    def _load_model(self):
+        from TTS.tts.configs.xtts_config import XttsConfig
+        from TTS.tts.models.xtts import Xtts
+
+        # Straight from the store, so nothing here can reach the network
+        model_dir = self.store.model_dir
+        logger.info(f"Loading XTTS v2 model on {self.device} ({self.precision}) from {model_dir}...")
+        config = XttsConfig()
+        config.load_json(os.path.join(model_dir, 'config.json'))
+        model = Xtts.init_from_config(config)
+        model.load_checkpoint(config, checkpoint_dir=model_dir, eval=True)
+        self._set_model(model.to(self.device), 'checkpoint')
+        logger.info(" XTTS v2 model loaded successfully")
+
+        # Copies downloaded before the store kept checksums are trusted once they load
+        if not self.store.has_manifest():
+            self.store.record()
+
+    def _load_snapshot(self):
+        """Map the snapshot in XTTS_SNAPSHOT instead of building the model; False if unusable"""
+        from xtts_snapshot import has_snapshot, load_snapshot
+
+        if not has_snapshot(self.snapshot_dir):
+            if self.snapshot_dir:
+                logger.warning(f"No snapshot in {self.snapshot_dir}, building the model "
+                               f"(create one with: python xtts_snapshot.py save)")
+            return False
+
+        self._set_state('loading', source='snapshot')
+        start = time.perf_counter()
+        try:
+            # A snapshot of another model or checkpoint would load cleanly with
+            # assign=True, so it has to match the one this engine serves
+            model = load_snapshot(self.snapshot_dir, model_name=self.model_name,
+                                  checkpoint_sha256=self.store.checksum())
+        except Exception as e:
+            logger.warning(f"Snapshot in {self.snapshot_dir} not used ({e}), building the model")
+            return False
+
+        # On CPU this keeps the mapped pages; CUDA copies them to the device once
+        self._set_model(model.to(self.device), 'snapshot')
+        logger.info(f" XTTS v2 snapshot mapped in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def _set_model(self, model, source):
+        self.model = model
+        self.model_source = source
+        self.config = model.config
+        self.sample_rate = self.config.audio.output_sample_rate
+
+    def _prepare_stages(self):
+        """Build optional accelerated implementations of the GPT / decoder stages"""
+        self._prepare_budget()
+        self.decoder = build_decoder(self.model, self.device, self.precision,
+                                     model_name=self.model_name, autocast=self._autocast)
+
+    def _warmup(self):
+        """Synthesize short texts per language and length bucket before reporting ready
+
+        The first request otherwise pays for lazy initialization: kernel
+        selection, allocator growth, tokenizer setup and new decoder shapes.
+        One extra run conditions on reference audio (decode, resample and
+        conditioning latents).
+        """
+        if os.getenv('XTTS_WARMUP', '1') == '0':
+            return
+
+        supported = set(getattr(self.config, 'languages', None) or WARMUP_PHRASES)
+        languages = []
+        for language in os.getenv('XTTS_WARMUP_LANGUAGES', 'en').split(','):
+            language = language.strip()
+            if language and language not in supported:
+                logger.warning(f"Skipping warmup for unsupported language '{language}'")
+            elif language:
+                languages.append(language)
+        lengths = [int(n) for n in os.getenv('XTTS_WARMUP_LENGTHS', '1,4').split(',') if n.strip()]
+        texts = [
+            (language, clauses, ', '.join([WARMUP_PHRASES.get(language, WARMUP_PHRASES['en'])] * clauses) + '.')
+            for language in languages for clauses in lengths
+        ]
+
+        start = time.perf_counter()
+        runs = []
+        reference = None
+        for index, (language, clauses, text) in enumerate(texts + texts[:1]):
+            self.state_details.update(warmup_run=index + 1, warmup_runs=len(texts) + 1)
+            # The last run clones the voice from the first run's audio
+            speaker_wav = reference if index == len(texts) else None
+            run_start = time.perf_counter()
+            wav, stats = self.synthesize(text, language=language, speaker_wav=speaker_wav,
+                                         return_stats=True)
+            runs.append({
+                'language': language,
+                'clauses': clauses,
+                'reference_audio': speaker_wav is not None,
+                'seconds': round(time.perf_counter() - run_start, 3),
+                'audio_seconds': round(len(wav) / self.sample_rate, 2),
+                'audio_tokens': stats['audio_tokens'],
+            })
+            if reference is None:
+                buffer = io.BytesIO()
+                torchaudio.save(buffer, torch.from_numpy(wav).unsqueeze(0), self.sample_rate,
+                                format='wav')
+                reference = buffer.getvalue()
+
+        self.warmup = {'seconds': round(time.perf_counter() - start, 2), 'runs': runs}
+        logger.info(f" Warmup: {len(runs)} runs in {self.warmup['seconds']}s "
+                    f"(first {runs[0]['seconds']}s)" if runs else " Warmup: nothing to run")
+
+    def _prepare_budget(self):
+        if self.length_margin > 0:
+            self.budget = GenerationBudget(self.model.gpt.max_gen_mel_tokens, self.length_margin)
+
+    def info(self):
+        """Engine details for /api/model/info"""
+        return {
+            'backend': self.backend,
+            'device': self.device,
+            'precision': self.precision,
+            'requested_precision': self.requested_precision,
+            'precision_fallback': self.precision_fallback,
+            'cpu_capabilities': self.cpu_capabilities,
+            'decoder': self.decoder.info() if self.decoder else {'mode': 'off'},
+            'prefix_cache': self.prefix_cache.info() if self.prefix_cache else None,
+            'text_cache': self.text_cache.info() if self.text_cache else None,
+            'voices': self.voices.info(),
+            'length_budget': self.budget.info() if self.budget else None,
+            'sample_rate': self.sample_rate,
+            'model_source': self.model_source,
+            'model_store': self.store.info(),
+            'warmup': self.warmup,
+            'startup': self.load_status(),
+        }
+
+    # ------------------------------------------------------------------------
+    # Conditioning
+    # ------------------------------------------------------------------------
+
+    def load_reference(self, speaker_wav, sample_rate=REFERENCE_SAMPLE_RATE):
+        """Decode reference audio (file path or raw file bytes) to a mono [1, T] tensor
+
+        Same steps as TTS's xtts.load_audio(), but bytes are decoded from
+        memory instead of being written to a temporary file first. WAV/FLAC
+        bytes are read by torchaudio, compressed uploads by ffmpeg.
+        """
+        source = speaker_wav
+        if isinstance(speaker_wav, (bytes, bytearray, memoryview)):
+            if not is_pcm_container(speaker_wav):
+                audio = decode_compressed(speaker_wav, sample_rate)
+                return audio.clip_(-1, 1)
+            source = io.BytesIO(speaker_wav)
+
+        try:
+            audio, source_rate = torchaudio.load(source)
+        except Exception as e:
+            raise ValueError(f"Could not decode reference audio: {e}") from e
+
+        if audio.size(0) != 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        if source_rate != sample_rate:
+            audio = torchaudio.functional.resample(audio, source_rate, sample_rate)
+        audio.clip_(-1, 1)
+        return audio
+
+    def get_conditioning_latents(self, speaker_wav=None):
+        """Return (gpt_cond_latent, speaker_embedding) for a reference or the default speaker
+
+        speaker_wav may be a file path or the raw bytes of an audio file.
+        """
+        if speaker_wav:
+            audio = self.load_reference(speaker_wav)
+            audio = audio[:, :REFERENCE_SAMPLE_RATE * self.config.max_ref_len].to(self.device)
+            if self.config.sound_norm_refs:
+                audio = (audio / torch.abs(audio).max()) * 0.75
+
+            speaker_embedding = self.model.get_speaker_embedding(audio, REFERENCE_SAMPLE_RATE)
+            gpt_cond_latent = self.model.get_gpt_cond_latents(
+                audio,
+                REFERENCE_SAMPLE_RATE,
+                length=self.config.gpt_cond_len,
+                chunk_length=self.config.gpt_cond_chunk_len,
+            )
+            return gpt_cond_latent, speaker_embedding
+
+        speaker_manager = getattr(self.model, 'speaker_manager', None)
+        if speaker_manager is None or not speaker_manager.speakers:
+            raise ValueError("Reference audio is required: model has no built-in speakers")
+
+        name = os.getenv('XTTS_DEFAULT_SPEAKER') or next(iter(speaker_manager.speakers))
+        if name not in speaker_manager.speakers:
+            raise ValueError(f"Unknown default speaker: {name}")
+        latents = speaker_manager.speakers[name]
+        return latents['gpt_cond_latent'], latents['speaker_embedding']
+
+    def register_voice(self, voice_id, speaker_wav):
+        """Condition on reference audio once and keep the latents under voice_id"""
+        if self.model is None:
+            raise RuntimeError("XTTS model not loaded")
+        if not voice_id:
+            raise ValueError("voice_id is required")
+
+        with self._lock, torch.inference_mode():
+            gpt_cond_latent, speaker_embedding = self.get_conditioning_latents(speaker_wav)
+        self.voices.put(voice_id, (gpt_cond_latent, speaker_embedding))
+        return voice_key(gpt_cond_latent)
+
+    def _voice_latents(self, speaker_wav=None, voice_id=None):
+        if voice_id:
+            latents = self.voices.get(voice_id)
+            if latents is None:
+                raise ValueError(f"Unknown voice: {voice_id}")
+            return latents
+        return self.get_conditioning_latents(speaker_wav)
+
+    # ------------------------------------------------------------------------
+    # Synthesis
+    # ------------------------------------------------------------------------
+
+    def synthesize(self, text, language='en', speaker_wav=None, voice_id=None, temperature=None,
+                   top_p=None, top_k=None, speed=1.0, length_penalty=None,
+                   repetition_penalty=None, return_stats=False):
+        """Generate speech for text; returns a float32 numpy waveform at self.sample_rate
+
+        With return_stats=True returns (wav, stats) where stats reports audio
+        tokens generated, the token budget and how many sentences hit it.
+        """
+        wavs, stats = self.synthesize_chunks(
+            [text], language=language, speaker_wav=speaker_wav, voice_id=voice_id,
+            temperature=temperature, top_p=top_p, top_k=top_k, speed=speed,
+            length_penalty=length_penalty, repetition_penalty=repetition_penalty,
+        )
+        return (wavs[0], stats) if return_stats else wavs[0]
+
+    def synthesize_chunks(self, chunks, **kwargs):
+        """Generate one waveform per text chunk with a single conditioning pass
+
+        Returns (wavs, stats) with stats summed over all chunks.
+        """
+        wavs = []
+        stats = {'sentences': 0, 'audio_tokens': 0, 'token_budget': 0, 'truncated_sentences': 0}
+        for wav, chunk_stats in self.synthesize_iter(chunks, **kwargs):
+            wavs.append(wav)
+            for key in stats:
+                stats[key] += chunk_stats[key]
+        return wavs, stats
+
+    def synthesize_iter(self, chunks, language='en', speaker_wav=None, voice_id=None,
+                        temperature=None, top_p=None, top_k=None, speed=1.0,
+                        length_penalty=None, repetition_penalty=None):
+        """Yield (wav, stats) for each text chunk as soon as it is generated
+
+        The voice is conditioned once (or taken from a registered voice_id).
+        The model lock is held per chunk, so other requests can run between
+        the chunks of a long stream.
+        """
+        if self.model is None:
+            raise RuntimeError("XTTS model not loaded")
+
+        settings = {
+            'temperature': self.config.temperature if temperature is None else float(temperature),
+            'top_p': self.config.top_p if top_p is None else float(top_p),
+            'top_k': self.config.top_k if top_k is None else int(top_k),
+            'length_penalty': self.config.length_penalty if length_penalty is None else float(length_penalty),
+            'repetition_penalty': (
+                self.config.repetition_penalty if repetition_penalty is None else float(repetition_penalty)
+            ),
+        }
+        speed = float(speed or 1.0)
+
+        with self._lock, torch.inference_mode():
+            gpt_cond_latent, speaker_embedding = self._voice_latents(speaker_wav, voice_id)
+
+        for text in chunks:
+            # requested - acquired is the queue depth on /metrics
+            metrics.inc('xtts_engine_lock_requested_total')
+            with self._lock, torch.inference_mode():
+                metrics.inc('xtts_engine_lock_acquired_total')
+                start = time.perf_counter()
+                try:
+                    wav, stats = self._inference(text, language, gpt_cond_latent,
+                                                 speaker_embedding, settings, speed)
+                except RuntimeError as e:
+                    if self.precision != 'bf16':
+                        raise
+                    # Some op/kernel combinations have no bf16 implementation on older
+                    # torch builds - drop back to fp32 for the rest of the process
+                    logger.warning(f"bf16 inference failed ({e}), falling back to fp32")
+                    self.precision = 'fp32'
+                    self.precision_fallback = str(e)
+                    if self.prefix_cache:
+                        self.prefix_cache.clear()
+                    wav, stats = self._inference(text, language, gpt_cond_latent,
+                                                 speaker_embedding, settings, speed)
+                elapsed = time.perf_counter() - start
+
+            record_synthesis(language, len(wav) / self.sample_rate, elapsed)
+            if stats['truncated_sentences']:
+                logger.warning(
+                    f"Audio token budget reached in {stats['truncated_sentences']} sentence(s) "
+                    f"[{language}] {text[:50]}..."
+                )
+            yield wav, stats
+
+    def _autocast(self):
+        if self.precision == 'bf16':
+            return torch.autocast('cpu', dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def segment(self, text, language):
+        """Split text into segments sized for one GPT generation each
+
+        Segments are packed as close as possible to the model's text-token
+        limit without exceeding it, and short enough that the expected speech
+        for the language fits in one generation.
+        """
+        lang = language.split('-')[0]
+        rate = self.budget.rate(lang) if self.budget else (
+            AUDIO_TOKENS_PER_CHAR.get(lang, DEFAULT_TOKENS_PER_CHAR)
+        )
+        max_chars = min(
+            int(self.segment_audio_tokens / rate),
+            self.model.tokenizer.char_limits.get(lang, 250),
+        )
+        max_tokens = self.model.args.gpt_max_text_tokens - 1
+
+        # Chunks that are already one segment (pre-split message chunks, gRPC
+        # segments) skip packing; their tokens are cached for _tokenize()
+        single = ' '.join(text.split())
+        if not single:
+            return []
+        if len(single) <= max_chars and len(self._encode(single, lang)) <= max_tokens:
+            return [single]
+
+        # Repeated messages reuse the whole segmentation
+        key = ('segments', single, lang, max_chars, max_tokens)
+        if self.text_cache is not None:
+            cached = self.text_cache.get(key)
+            if cached is not None:
+                return list(cached)
+
+        # Packing probes every growing candidate; cached entries are used but
+        # the one-off prefixes stay in a local memo so they never evict real
+        # entries from the text cache
+        probes = {}
+
+        def count_tokens(candidate):
+            probe = candidate.strip().lower()
+            if probe not in probes:
+                entry = self.text_cache.get((probe, lang)) if self.text_cache is not None else None
+                probes[probe] = entry or self._normalize_and_encode(probe, lang)
+            return len(probes[probe][1])
+
+        segments = segment_text(
+            text, lang,
+            count_tokens=count_tokens,
+            max_tokens=max_tokens,
+            max_chars=max_chars,
+        )
+        if self.text_cache is not None:
+            for segment in segments:
+                probe = segment.strip().lower()
+                if probe in probes:
+                    self.text_cache.put((probe, lang), probes[probe])
+            self.text_cache.put(key, tuple(segments))
+        return segments
+
+    def _encode(self, sentence, lang):
+        return self._text_entry(sentence.strip().lower(), lang)[1]
+
+    def _text_entry(self, text, lang):
+        """(normalized text, token ids) for lowercased text, memoized per language"""
+        if self.text_cache is None:
+            return self._normalize_and_encode(text, lang)
+        return self.text_cache.get_or_compute(
+            (text, lang), lambda: self._normalize_and_encode(text, lang)
+        )
+
+    def _normalize_and_encode(self, text, lang):
+        # Same steps as VoiceBpeTokenizer.encode(), split so the cleaned text is kept
+        tokenizer = self.model.tokenizer
+        normalized = tokenizer.preprocess_text(text, lang)
+        tagged = f"[{'zh-cn' if lang == 'zh' else lang}]{normalized}".replace(' ', '[SPACE]')
+        return normalized, tuple(tokenizer.tokenizer.encode(tagged).ids)
+
+    def _tokenize(self, sentence, lang):
+        tokens = self._encode(sentence, lang)
+        if len(tokens) >= self.model.args.gpt_max_text_tokens:
+            raise ValueError(
+                f"Text too long: {len(tokens)} tokens (max {self.model.args.gpt_max_text_tokens})"
+            )
+        return torch.IntTensor(list(tokens)).unsqueeze(0).to(self.device)
+
+    def _generate_codes(self, text_tokens, gpt_cond_latent, settings, prefix_key=None,
+                        max_new_tokens=None):
+        """GPT stage: sample at most max_new_tokens audio codes for one sentence"""
+        gpt = self.model.gpt
+        max_new_tokens = max_new_tokens or gpt.max_gen_mel_tokens
+
+        # compute_embeddings() stores [cond | text] as the inference prefix and
+        # returns placeholder ids ending in the start-audio token
+        gpt_inputs = gpt.compute_embeddings(gpt_cond_latent, text_tokens)
+        generate_kwargs = {}
+
+        if self.prefix_cache is not None and prefix_key is not None:
+            prefix_past = self.prefix_cache.get_or_compute(
+                (prefix_key, self.precision),
+                lambda: _freeze_past(gpt.gpt_inference.transformer(
+                    inputs_embeds=gpt_cond_latent, use_cache=True, return_dict=True
+                ).past_key_values),
+            )
+            # Only the text part is run here, on top of the cached conditioning
+            # state; generate() then continues from the start-audio token as it
+            # would after a full prefix pass
+            text_emb = gpt.gpt_inference.cached_prefix_emb[:, gpt_cond_latent.shape[1]:]
+            generate_kwargs['past_key_values'] = gpt.gpt_inference.transformer(
+                inputs_embeds=text_emb, past_key_values=_thaw_past(prefix_past),
+                use_cache=True, return_dict=True
+            ).past_key_values
+
+        codes = gpt.gpt_inference.generate(
+            gpt_inputs,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=max_new_tokens + gpt_inputs.shape[-1],
+            do_sample=True,
+            num_beams=1,
+            num_return_sequences=self.model.gpt_batch_size,
+            output_attentions=False,
+            **settings,
+            **generate_kwargs,
+        )
+        return codes[:, gpt_inputs.shape[1]:]
+
+    def _gpt_latents(self, text_tokens, gpt_codes, gpt_cond_latent):
+        """GPT stage: latent sequence for the sampled codes (decoder input)"""
+        expected_output_len = torch.tensor(
+            [gpt_codes.shape[-1] * self.model.gpt.code_stride_len], device=self.device
+        )
+        text_len = torch.tensor([text_tokens.shape[-1]], device=self.device)
+        return self.model.gpt(
+            text_tokens,
+            text_len,
+            gpt_codes,
+            expected_output_len,
+            cond_latents=gpt_cond_latent,
+            return_attentions=False,
+            return_latent=True,
+        )
+
+    def _decode(self, gpt_latents, speaker_embedding):
+        """Decoder stage: HiFi-GAN vocoder from GPT latents to waveform"""
+        if self.decoder is not None:
+            return self.decoder(gpt_latents, speaker_embedding)
+        return self.model.hifigan_decoder(gpt_latents, g=speaker_embedding)
+
+    def _inference(self, text, language, gpt_cond_latent, speaker_embedding, settings, speed):
+        lang = language.split('-')[0]
+        length_scale = 1.0 / max(speed, 0.05)
+        gpt_cond_latent = gpt_cond_latent.to(self.device)
+        speaker_embedding = speaker_embedding.to(self.device)
+        prefix_key = voice_key(gpt_cond_latent) if self.prefix_cache else None
+        stop_token = self.model.gpt.stop_audio_token
+
+        wavs = []
+        stats = {'sentences': 0, 'audio_tokens': 0, 'token_budget': 0, 'truncated_sentences': 0}
+        for sentence in self.segment(text, lang):
+            text_tokens = self._tokenize(sentence, lang)
+            max_new_tokens = self.budget.tokens_for(sentence, lang) if self.budget else None
+
+            with self._autocast():
+                gpt_codes = self._generate_codes(text_tokens, gpt_cond_latent, settings,
+                                                 prefix_key, max_new_tokens)
+                gpt_latents = self._gpt_latents(text_tokens, gpt_codes, gpt_cond_latent)
+
+                if length_scale != 1.0:
+                    gpt_latents = F.interpolate(
+                        gpt_latents.transpose(1, 2), scale_factor=length_scale, mode="linear"
+                    ).transpose(1, 2)
+
+                wav = self._decode(gpt_latents, speaker_embedding)
+
+            # numpy has no bfloat16, always hand back fp32 samples
+            wavs.append(wav.float().cpu().squeeze())
+
+            tokens = gpt_codes.shape[-1]
+            truncated = bool(
+                max_new_tokens and tokens >= max_new_tokens and int(gpt_codes[0, -1]) != stop_token
+            )
+            if self.budget:
+                self.budget.observe(sentence, lang, tokens, truncated)
+            stats['sentences'] += 1
+            stats['audio_tokens'] += tokens
+            stats['token_budget'] += max_new_tokens or 0
+            stats['truncated_sentences'] += int(truncated)
+
+        if not wavs:
+            raise ValueError("Text is empty after normalization")
+        return torch.cat(wavs, dim=0).numpy(), stats
+
+
+def create_engine(backend=None, **kwargs):
+    """Instantiate the engine selected by backend or XTTS_BACKEND (not loaded yet)"""
+    backend = (backend or os.getenv('XTTS_BACKEND', 'torch')).lower()
+    if backend == 'onnx':
+        from xtts_onnx import ONNXEngine
+        return ONNXEngine(**kwargs)
+    if backend != 'torch':
+        logger.warning(f"Unknown XTTS_BACKEND '{backend}', using torch")
+    return XTTSEngine(**kwargs)
@@ -8,13 +8,11 @@ import os
 import sys
 import json
 import logging
-import io
 from pathlib import Path
 
 # Set environment variables BEFORE importing TTS
-os.environ['TTS_HOME'] = '/tmp/tts_models'
+# (the model itself lives in the persistent store, see xtts_store.py)
 os.environ['PYTHONUNBUFFERED'] = '1'
-os.makedirs(os.environ['TTS_HOME'], exist_ok=True)
 
 # Configure logging
 logging.basicConfig(
@@ -31,8 +29,11 @@ print("="*60 + "\n")
 print("1. Importing libraries...")
 try:
     import torch
-    from flask import Flask, request, jsonify, send_file
+    from flask import Flask, request, jsonify
     from flask_cors import CORS
+    from xtts_engine import XTTSEngine
+    from xtts_audio import AudioEncoder, negotiate_output
+    from xtts_http import serve, health_routes, limit_request_bodies, metrics_routes, read_upload
     print("    Flask & Torch imported")
 except Exception as e:
     print(f"   Error: {e}")
@@ -53,32 +54,24 @@ sys.modules['builtins'].input = LicenseBypassInput()
 print("    License check patched")
 
 print("3. Loading XTTS model...")
-try:
-    from TTS.api import TTS
-    
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"   🖥️  Device: {device}")
-    
-    # Torch patch for weights_only compatibility
-    torch.serialization.safe_load = lambda *args, **kwargs: torch.load(*args, **kwargs, weights_only=False)
-    
-    # Load model
-    print("    Downloading model (first time: 2-5 minutes)...")
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True, gpu=(device=="cuda"))
-    tts = tts.to(device)
-    
-    print("    Model loaded successfully!")
-    MODEL_READY = True
-    
-except Exception as e:
-    print(f"   Error loading model: {e}")
-    import traceback
-    traceback.print_exc()
-    MODEL_READY = False
+engine = XTTSEngine()
+encoder = AudioEncoder()
+device = engine.device
+print(f"   🖥️  Device: {device}")
+
+# Torch patch for weights_only compatibility
+torch.serialization.safe_load = lambda *args, **kwargs: torch.load(*args, **kwargs, weights_only=False)
+
+# Load model in the background; /health reports progress meanwhile
+print("    Downloading model in the background (first time: 2-5 minutes)...")
+engine.load_in_background()
 
 # Flask app
 app = Flask(__name__)
 CORS(app)
+limit_request_bodies(app)
+health_routes(app, engine)
+metrics_routes(app, engine)
 
 print("\n" + "="*60)
 print("🌐 API Endpoints Ready")
@@ -88,7 +81,8 @@ print("="*60 + "\n")
 def health():
     """Health check endpoint"""
     return jsonify({
-        'status': 'ready' if MODEL_READY else 'loading',
+        'status': engine.state,
+        'startup': engine.load_status(),
         'model': 'xtts_v2',
         'device': 'cuda' if torch.cuda.is_available() else 'cpu'
     })
@@ -97,8 +91,8 @@ def health():
 def synthesize():
     """Synthesize speech from text with optional voice cloning"""
     
-    if not MODEL_READY:
-        return jsonify({'error': 'Model still loading'}), 503
+    if not engine.ready:
+        return jsonify({'error': 'Model still loading', 'state': engine.state}), 503
     
     try:
         # Get data from JSON or form
@@ -114,45 +108,24 @@ def synthesize():
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
+        try:
+            output = negotiate_output(request, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         logger.info(f"🎤 Synthesizing: [{language}] {text[:50]}...")
         
         # Handle speaker WAV file for voice cloning
         if 'speaker_wav' in request.files:
-            wav_file = request.files['speaker_wav']
-            speaker_wav = f"/tmp/speaker_{os.urandom(4).hex()}.wav"
-            wav_file.save(speaker_wav)
+            speaker_wav = read_upload(request.files['speaker_wav'])
             logger.info(f"📢 Using voice profile for cloning")
         
-        # Generate audio
-        output_path = f"/tmp/output_{os.urandom(4).hex()}.wav"
-        
-        tts.tts_to_file(
-            text=text,
-            speaker_wav=speaker_wav,
-            language=language,
-            file_path=output_path
-        )
-        
-        # Read output
-        with open(output_path, 'rb') as f:
-            audio_data = f.read()
-        
-        # Cleanup
-        try:
-            os.remove(output_path)
-            if speaker_wav and os.path.exists(speaker_wav):
-                os.remove(speaker_wav)
-        except:
-            pass
-        
-        logger.info(f" Generated {len(audio_data)} bytes audio")
+        # Generate audio straight into the response body
+        wav = engine.synthesize(text=text, language=language, speaker_wav=speaker_wav)
         
-        return send_file(
-            io.BytesIO(audio_data),
-            mimetype='audio/wav',
-            as_attachment=True,
-            download_name='output.wav'
-        )
+        response = encoder.response(wav, engine.sample_rate, output)
+        logger.info(f" Generated {response.content_length} bytes audio")
+        return response
     
     except Exception as e:
         logger.error(f"Synthesis error: {e}")
@@ -170,4 +143,4 @@ if __name__ == '__main__':
     print(f"     API: POST http://localhost:{port}/api/synthesize")
     print("\n" + "="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=port, debug=False, threaded=True, use_reloader=False)
+    serve(app, port=port)
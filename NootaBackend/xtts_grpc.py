@@ -0,0 +1,197 @@
+"""
+gRPC interface for the XTTS v2 engine (see xtts.proto)
+
+Runs inside the HTTP server process and uses the same engine slot and
+encoder pool, so registered voices, KV/text caches, the model lock and hot
+swaps are shared with the HTTP endpoints. Each RPC is pinned to the engine
+that was serving when it started. Message classes are generated from
+xtts.proto at startup (grpcio-tools), no generated code is checked in.
+
+Environment:
+  XTTS_GRPC_PORT     - TCP port for the gRPC server (default: off)
+  XTTS_GRPC_SOCKET   - Unix socket path for the gRPC server (default: off)
+  XTTS_GRPC_WORKERS  - concurrent RPC handler threads (default: 8)
+"""
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+from xtts_audio import encode_raw, resample, resolve_output
+
+logger = logging.getLogger(__name__)
+
+PROTO_FILE = 'xtts.proto'
+
+STREAM_FORMATS = ('pcm', 'opus')
+
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+class XTTSServicer:
+    """Implements the XTTS service on top of an EngineSlot and AudioEncoder"""
+
+    def __init__(self, engines, encoder, protos):
+        self.engines = engines
+        self.encoder = encoder
+        self.protos = protos
+
+    def _check_request(self, engine, request, context):
+        if not engine.ready:
+            context.abort(grpc.StatusCode.UNAVAILABLE, f'XTTS model not loaded ({engine.state})')
+        if not request.text.strip():
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'text is required')
+
+    def _options(self, request):
+        options = {'language': request.language or 'en'}
+        voice = request.WhichOneof('voice')
+        if voice == 'voice_id':
+            options['voice_id'] = request.voice_id
+        elif voice == 'reference_audio':
+            options['speaker_wav'] = request.reference_audio
+        for field in ('temperature', 'top_p', 'top_k', 'speed'):
+            if request.HasField(field):
+                options[field] = getattr(request, field)
+        return options
+
+    def _output(self, request, fmt):
+        return resolve_output({
+            'format': fmt,
+            'sample_rate': request.sample_rate or None,
+            'sample_format': request.sample_format or None,
+        })
+
+    def Synthesize(self, request, context):
+        with self.engines.use() as engine:
+            self._check_request(engine, request, context)
+            try:
+                output = self._output(request, request.format or 'wav')
+                wav, stats = engine.synthesize(request.text.strip(), return_stats=True,
+                                               **self._options(request))
+                audio, _, output_rate = self.encoder.encode(wav, engine.sample_rate, output)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+            return self.protos.SynthesizeResponse(
+                audio=audio,
+                format=output.format,
+                sample_rate=output_rate,
+                duration=len(wav) / engine.sample_rate,
+                audio_tokens=stats['audio_tokens'],
+                token_budget_hit=stats['truncated_sentences'] > 0,
+            )
+
+    def SynthesizeStream(self, request, context):
+        fmt = (request.format or 'pcm').lower()
+        if fmt not in STREAM_FORMATS:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"Stream format must be one of {', '.join(STREAM_FORMATS)}")
+
+        # The engine stays pinned until the stream ends or is cancelled
+        with self.engines.use() as engine:
+            self._check_request(engine, request, context)
+            source_rate = engine.sample_rate
+            try:
+                output = self._output(request, 'opus' if fmt == 'opus' else 'wav')
+                options = self._options(request)
+                segments = engine.segment(request.text.strip(), options['language'])
+                chunks = engine.synthesize_iter(segments, **options)
+
+                offset = 0.0
+                for index, (segment, (wav, stats)) in enumerate(zip(segments, chunks)):
+                    # Deadline passed or client cancelled: stop generating
+                    if not context.is_active():
+                        logger.info(f"gRPC stream cancelled after {index} segment(s)")
+                        return
+
+                    if fmt == 'opus':
+                        audio, _, output_rate = self.encoder.encode(wav, source_rate, output)
+                    else:
+                        output_rate = output.sample_rate or source_rate
+                        audio = encode_raw(resample(wav, source_rate, output_rate), output.sample_format)
+
+                    duration = len(wav) / source_rate
+                    yield self.protos.AudioChunk(
+                        audio=audio,
+                        index=index,
+                        text=segment,
+                        format=fmt,
+                        sample_format=output.sample_format if fmt == 'pcm' else '',
+                        sample_rate=output_rate,
+                        offset=offset,
+                        duration=duration,
+                        audio_tokens=stats['audio_tokens'],
+                        token_budget_hit=stats['truncated_sentences'] > 0,
+                    )
+                    offset += duration
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def RegisterVoice(self, request, context):
+        with self.engines.use() as engine:
+            if not engine.ready:
+                context.abort(grpc.StatusCode.UNAVAILABLE, f'XTTS model not loaded ({engine.state})')
+            if not request.reference_audio:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'reference_audio is required')
+            try:
+                key = engine.register_voice(request.voice_id, request.reference_audio)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        logger.info(f" Registered voice {request.voice_id}")
+        return self.protos.RegisterVoiceResponse(voice_id=request.voice_id, voice_key=key)
+
+    def Health(self, request, context):
+        engine = self.engines.current
+        status = engine.load_status()
+        return self.protos.HealthResponse(
+            ready=engine.ready,
+            state=status['state'],
+            progress=status['progress'] or 0.0,
+            device=engine.device,
+            backend=engine.backend,
+            precision=engine.precision,
+            generation=self.engines.generation,
+        )
+
+
+def start_grpc_server(engines, encoder):
+    """Start the gRPC server in background threads when a port or socket is configured"""
+    port = os.getenv('XTTS_GRPC_PORT')
+    socket_path = os.getenv('XTTS_GRPC_SOCKET')
+    if not port and not socket_path:
+        return None
+    if grpc is None:
+        logger.warning("XTTS_GRPC_PORT/XTTS_GRPC_SOCKET set but grpcio is not installed")
+        return None
+
+    try:
+        protos, services = grpc.protos_and_services(PROTO_FILE)
+    except Exception as e:
+        logger.warning(f"gRPC disabled, could not load {PROTO_FILE} (needs grpcio-tools): {e}")
+        return None
+
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=int(os.getenv('XTTS_GRPC_WORKERS', 8)),
+                           thread_name_prefix='xtts-grpc'),
+        options=[
+            ('grpc.max_receive_message_length', MAX_MESSAGE_BYTES),
+            ('grpc.max_send_message_length', MAX_MESSAGE_BYTES),
+        ],
+    )
+    services.add_XTTSServicer_to_server(XTTSServicer(engines, encoder, protos), server)
+
+    if port:
+        server.add_insecure_port(f'[::]:{port}')
+        logger.info(f" gRPC listening on port {port}")
+    if socket_path:
+        server.add_insecure_port(f'unix:{socket_path}')
+        logger.info(f" gRPC listening on unix:{socket_path}")
+
+    server.start()
+    return server
@@ -0,0 +1,357 @@
+"""
+HTTP listeners for the XTTS servers
+Serves a Flask app on TCP, on a Unix domain socket, or on both at once.
+With cheroot installed the listeners speak HTTP/1.1 keep-alive, so a
+co-located Node backend reuses its connections; Werkzeug's development
+server (the fallback) closes the connection after every response.
+Request bodies are size-limited per endpoint and parsed before the view
+runs, with uploaded files kept in preallocated memory buffers.
+Liveness and readiness probes report the engine's background startup, and
+/metrics exposes Prometheus metrics for every request.
+
+Environment:
+  XTTS_SOCKET       - Unix socket path to listen on (default: none)
+  XTTS_SOCKET_MODE  - octal permissions for the socket file (default: 660)
+  XTTS_TCP          - 0 to skip the TCP listener when XTTS_SOCKET is set (default: 1)
+  XTTS_HTTP_THREADS - cheroot worker threads per listener (default: 32)
+  XTTS_BODY_LIMITS  - per-endpoint body limits, e.g. "/api/tts=8M,/api/segment=64K"
+  XTTS_MAX_REFERENCE - largest accepted reference audio upload (default: 10M)
+"""
+
+import os
+import time
+import logging
+import threading
+
+from flask import Request, Response, g, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.serving import make_server
+
+try:
+    from cheroot.wsgi import Server as WSGIServer
+except ImportError:
+    WSGIServer = None
+
+from xtts_metrics import engine_lines, language_label, metrics
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Endpoints that carry reference audio get room for it; everything else is
+# small JSON
+AUDIO_BODY_LIMIT = 16 * 1024 ** 2
+DEFAULT_BODY_LIMIT = 1024 ** 2
+DEFAULT_BODY_LIMITS = {
+    '/api/tts': AUDIO_BODY_LIMIT,
+    '/api/tts/batch': AUDIO_BODY_LIMIT,
+    '/api/tts/message': AUDIO_BODY_LIMIT,
+    '/api/synthesize': AUDIO_BODY_LIMIT,
+    '/generate': AUDIO_BODY_LIMIT,
+    '/api/predict': AUDIO_BODY_LIMIT,
+}
+DEFAULT_MAX_REFERENCE = 10 * 1024 ** 2
+
+# First allocation for uploads whose size is not known up front
+INITIAL_BUFFER = 256 * 1024
+
+RAW_AUDIO_TYPES = ('application/octet-stream',)
+
+
+def parse_size(value):
+    """'16M' / '512K' / '1048576' -> bytes"""
+    value = str(value).strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+    return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def parse_limits(value):
+    """'/api/tts=8M,/api/segment=64K' -> {'/api/tts': 8388608, ...}"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            path, size = item.split('=', 1)
+            limits[path.strip()] = parse_size(size)
+    return limits
+
+# ============================================================================
+# REQUEST BODIES
+# ============================================================================
+
+class PreallocatedBuffer:
+    """In-memory file for request bodies and uploads, backed by one bytearray
+
+    The buffer is allocated once from the known size (Content-Length) and
+    only grows, by doubling, for bodies of unknown length. Writing past
+    `limit` raises 413 instead of growing further.
+    """
+
+    def __init__(self, capacity, limit):
+        self.limit = limit
+        self._buffer = bytearray(min(max(capacity, 0), limit))
+        self._size = 0
+        self._pos = 0
+
+    def write(self, data):
+        end = self._size + len(data)
+        if end > self.limit:
+            raise RequestEntityTooLarge(f"Upload exceeds {self.limit} bytes")
+        if end > len(self._buffer):
+            grow = max(end, min(self.limit, max(INITIAL_BUFFER, 2 * len(self._buffer))))
+            self._buffer.extend(bytes(grow - len(self._buffer)))
+        self._buffer[self._size:end] = data
+        self._size = end
+        return len(data)
+
+    def getbuffer(self):
+        """Zero-copy view of the bytes written so far"""
+        return memoryview(self._buffer)[:self._size]
+
+    def read(self, size=-1):
+        end = self._size if size is None or size < 0 else min(self._size, self._pos + size)
+        data = bytes(self._buffer[self._pos:end])
+        self._pos = end
+        return data
+
+    def seek(self, pos, whence=0):
+        base = {0: 0, 1: self._pos, 2: self._size}[whence]
+        self._pos = max(0, min(self._size, base + pos))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedRequest(Request):
+    """Request whose limits come from the endpoint and whose uploads stay in memory"""
+
+    body_limit = None
+    max_reference = DEFAULT_MAX_REFERENCE
+
+    @property
+    def max_content_length(self):
+        # Also enforced while reading bodies without a Content-Length
+        return self.body_limit or super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        capacity = content_length or total_content_length or INITIAL_BUFFER
+        return PreallocatedBuffer(capacity, self.max_reference)
+
+
+def read_body(limit):
+    """Read the raw request body in chunks into a preallocated buffer"""
+    buffer = PreallocatedBuffer(request.content_length or INITIAL_BUFFER, limit)
+    stream = request.stream
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        buffer.write(chunk)
+    return buffer.getbuffer()
+
+
+def raw_body():
+    """Raw audio body parsed by limit_request_bodies(), or None"""
+    return g.get('raw_body')
+
+
+def read_upload(upload):
+    """Bytes of an uploaded file; a zero-copy view when it sits in a PreallocatedBuffer"""
+    if upload is None:
+        return None
+    if isinstance(upload.stream, PreallocatedBuffer):
+        return upload.stream.getbuffer()
+    return upload.read()
+
+
+def limit_request_bodies(app, limits=None):
+    """Reject oversized bodies early and parse the rest before the view runs
+
+    A Content-Length over the endpoint's limit is refused before any of the
+    body is read. Multipart uploads are parsed part by part into memory
+    buffers, raw audio bodies are read into one buffer, and parse failures
+    surface as 4xx responses rather than inside the views.
+    """
+    limits = {**DEFAULT_BODY_LIMITS, **(limits or {}), **parse_limits(os.getenv('XTTS_BODY_LIMITS'))}
+    max_reference = parse_size(os.getenv('XTTS_MAX_REFERENCE', DEFAULT_MAX_REFERENCE))
+    app.request_class = BufferedRequest
+
+    def too_large(message):
+        # The unread body would otherwise be parsed as the next request
+        response = jsonify({'error': message})
+        response.status_code = 413
+        response.headers['Connection'] = 'close'
+        return response
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def request_too_large(error):
+        return too_large(error.description or 'Request body too large')
+
+    @app.before_request
+    def parse_body():
+        limit = limits.get(request.path, DEFAULT_BODY_LIMIT)
+        length = request.content_length
+        if length is not None and length > limit:
+            logger.warning(f"Rejected {length} byte body for {request.path} (limit {limit})")
+            return too_large(f"Request body of {length} bytes exceeds the {limit} byte limit")
+
+        request.body_limit = limit
+        request.max_reference = max_reference
+        if request.mimetype == 'multipart/form-data':
+            request.form  # parses every part now, files into PreallocatedBuffers
+        elif request.mimetype.startswith('audio/') or request.mimetype in RAW_AUDIO_TYPES:
+            if length is not None and length > max_reference:
+                return too_large(f"Reference audio exceeds {max_reference} bytes")
+            g.raw_body = read_body(min(limit, max_reference))
+        elif request.is_json:
+            request.get_json(silent=True)
+
+# ============================================================================
+# HEALTH PROBES
+# ============================================================================
+
+def health_routes(app, engine):
+    """Add /health/live and /health/ready for an engine loading in the background
+
+    Liveness only fails once loading has failed, so a slow first download is
+    not restarted; readiness fails until the model can serve requests.
+    """
+    @app.route('/health/live', methods=['GET'])
+    def liveness():
+        status = engine.load_status()
+        alive = engine.state != 'failed'
+        return jsonify({'alive': alive, **status}), 200 if alive else 503
+
+    @app.route('/health/ready', methods=['GET'])
+    def readiness():
+        status = engine.load_status()
+        return jsonify({'ready': engine.ready, **status}), 200 if engine.ready else 503
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+def _request_language():
+    data = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(data, dict):
+        data = request.values
+    if data.get('languages'):
+        return 'multi'
+    return language_label(data.get('language'))
+
+
+def metrics_routes(app, engine, engines=None):
+    """Time every request and serve GET /metrics in the Prometheus text format"""
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        metrics.inc('xtts_requests_started_total')
+
+    # First, so requests refused by the body limits are counted too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(error=None):
+        # Runs after the last byte for streamed responses (stream_with_context)
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        metrics.inc('xtts_requests_finished_total')
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = g.pop('metrics_status', 500)
+        # A 413 body was never read; parsing it now would defeat the limit
+        language = _request_language() if status != 413 else 'none'
+        metrics.inc('xtts_requests_total', endpoint=endpoint, language=language, status=str(status))
+        metrics.observe('xtts_request_duration_seconds', time.perf_counter() - start,
+                        endpoint=endpoint, language=language)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        totals = metrics.totals()
+        lines = metrics.render(totals) + engine_lines(engine, totals, engines)
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# ============================================================================
+# LISTENERS
+# ============================================================================
+
+class KeepAliveServer:
+    """cheroot listener (HTTP/1.1 keep-alive) with the serve_forever() interface"""
+
+    def __init__(self, bind_addr, app):
+        self.server = WSGIServer(
+            bind_addr, app,
+            numthreads=int(os.getenv('XTTS_HTTP_THREADS', 32)),
+            # Idle keep-alive connections are closed after this many seconds
+            timeout=60,
+        )
+        # Binds now (a stale socket file is removed) so permissions can be set
+        self.server.prepare()
+
+    def serve_forever(self):
+        self.server.serve()
+
+    def server_close(self):
+        self.server.stop()
+
+
+def _make_server(bind_addr, app):
+    """bind_addr is (host, port) or a Unix socket path"""
+    if WSGIServer is not None:
+        return KeepAliveServer(bind_addr, app)
+    if isinstance(bind_addr, str):
+        # Werkzeug removes a stale socket file left by a previous run
+        return make_server(f'unix://{bind_addr}', 0, app, threaded=True)
+    return make_server(*bind_addr, app, threaded=True)
+
+
+def serve(app, host='0.0.0.0', port=8000):
+    """Run app on every configured listener until interrupted"""
+    socket_path = os.getenv('XTTS_SOCKET')
+    tcp = os.getenv('XTTS_TCP', '1') != '0' or not socket_path
+
+    if WSGIServer is None:
+        # Werkzeug >= 2.1 sends "Connection: close" on every response
+        logger.warning("cheroot is not installed, serving without keep-alive (pip install cheroot)")
+
+    servers = []
+    if socket_path:
+        server = _make_server(socket_path, app)
+        os.chmod(socket_path, int(os.getenv('XTTS_SOCKET_MODE', '660'), 8))
+        logger.info(f" Listening on unix://{socket_path}")
+        servers.append(server)
+    if tcp:
+        servers.append(_make_server((host, port), app))
+        logger.info(f" Listening on http://{host}:{port}")
+
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
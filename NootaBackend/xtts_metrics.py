@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the XTTS servers
+
+Counters and histograms live in per-thread shards: a thread only ever
+writes its own shard, so recording on the request and synthesis paths takes
+no lock. A scrape sums the shards (folding in those of finished threads)
+and renders the Prometheus text format together with gauges read from the
+engine at scrape time. No client library is needed.
+"""
+
+import os
+import sys
+import time
+import bisect
+import threading
+
+from xtts_text import SUPPORTED_LANGUAGES
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+RTF_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+
+# name -> (type, help, histogram buckets); type None is internal (not rendered)
+METRICS = {
+    'xtts_requests_total': (
+        'counter', 'HTTP requests by endpoint, language and status', None),
+    'xtts_request_duration_seconds': (
+        'histogram', 'HTTP request latency until the last byte is sent', LATENCY_BUCKETS),
+    'xtts_audio_seconds_total': (
+        'counter', 'Seconds of audio generated', None),
+    'xtts_synthesis_seconds_total': (
+        'counter', 'Seconds spent generating audio while holding the model', None),
+    'xtts_realtime_factor': (
+        'histogram', 'Generation time divided by audio duration, per synthesized chunk', RTF_BUCKETS),
+    'xtts_requests_started_total': (None, '', None),
+    'xtts_requests_finished_total': (None, '', None),
+    'xtts_engine_lock_requested_total': (None, '', None),
+    'xtts_engine_lock_acquired_total': (None, '', None),
+}
+
+KNOWN_LANGUAGES = set(SUPPORTED_LANGUAGES) | set(SUPPORTED_LANGUAGES.values())
+
+
+def language_label(language):
+    """Bounded label value for a client-supplied language code"""
+    if not language:
+        return 'none'
+    return language if language in KNOWN_LANGUAGES else 'other'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """Lock-free counters and histograms, summed across per-thread shards"""
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        # Only taken when a thread records for the first time and on scrapes
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name, value=1, **labels):
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        series = shard.get(key)
+        if series is None:
+            # One count per bucket, one for +Inf, then the sum
+            series = shard[key] = [0] * (len(self.definitions[name][2]) + 2)
+        series[bisect.bisect_left(self.definitions[name][2], value)] += 1
+        series[-1] += value
+
+    @staticmethod
+    def _merge(total, shard):
+        # dict.copy() is atomic under the GIL, so the owning thread can keep writing
+        for key, value in shard.copy().items():
+            if isinstance(value, list):
+                current = total.get(key)
+                if current is None:
+                    total[key] = list(value)
+                else:
+                    for i, count in enumerate(value):
+                        current[i] += count
+            else:
+                total[key] = total.get(key, 0) + value
+
+    def totals(self):
+        """{(name, labels): value} summed over every thread"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Werkzeug runs a thread per connection; keep their counts, not their shards
+                    self._merge(self._retired, shard)
+            self._shards = alive
+
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in alive:
+                self._merge(total, shard)
+        return total
+
+    @staticmethod
+    def sum(totals, name):
+        return sum(value for (key, _), value in totals.items() if key == name)
+
+    def render(self, totals):
+        """Prometheus text lines for every counter and histogram"""
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            if kind is None:
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (key, labels), value in sorted(totals.items()):
+                if key != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for le, count in zip(buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _format_value(float(le))),)
+                    lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+metrics = Metrics(METRICS)
+
+
+def record_synthesis(language, audio_seconds, seconds):
+    """Account one synthesized chunk (called by the engine)"""
+    label = language_label(language)
+    metrics.inc('xtts_audio_seconds_total', audio_seconds, language=label)
+    metrics.inc('xtts_synthesis_seconds_total', seconds, language=label)
+    if audio_seconds > 0:
+        metrics.observe('xtts_realtime_factor', seconds / audio_seconds, language=label)
+
+
+def gauge(name, help_text, samples, kind='gauge'):
+    """Prometheus text lines for values read at scrape time: [(labels dict, value)]"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}')
+    return lines
+
+
+def process_rss_bytes():
+    """Current resident set size (peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def engine_lines(engine, totals, engines=None):
+    """Gauges for the load state, queue, caches and process memory"""
+    from xtts_engine import LOAD_STATES
+
+    states = LOAD_STATES + ('failed', 'unloaded')
+    status = engine.load_status()
+    lines = gauge('xtts_model_state', 'Current engine load state (1 for the active state)',
+                  [({'state': state}, int(engine.state == state)) for state in states])
+    lines += gauge('xtts_model_load_progress', 'Progress through the startup stages (0-1)',
+                   [({}, status['progress'] or 0)])
+    lines += gauge('xtts_model_ready', 'Whether the engine serves synthesis requests',
+                   [({}, int(engine.ready))])
+    if engines is not None:
+        lines += gauge('xtts_engine_generation', 'Engine generation, bumped by every hot swap',
+                       [({}, engines.generation)])
+
+    lines += gauge('xtts_requests_in_flight', 'HTTP requests currently being handled',
+                   [({}, metrics.sum(totals, 'xtts_requests_started_total')
+                         - metrics.sum(totals, 'xtts_requests_finished_total'))])
+    lines += gauge('xtts_engine_queue_depth', 'Synthesis chunks waiting for the model lock',
+                   [({}, metrics.sum(totals, 'xtts_engine_lock_requested_total')
+                         - metrics.sum(totals, 'xtts_engine_lock_acquired_total'))])
+
+    caches = [(name, cache) for name, cache in (
+        ('prefix', engine.prefix_cache), ('text', engine.text_cache), ('voices', engine.voices)
+    ) if cache is not None]
+    lines += gauge('xtts_cache_hits_total', 'Engine cache hits',
+                   [({'cache': name}, cache.hits) for name, cache in caches], kind='counter')
+    lines += gauge('xtts_cache_misses_total', 'Engine cache misses',
+                   [({'cache': name}, cache.misses) for name, cache in caches], kind='counter')
+    lines += gauge('xtts_cache_hit_ratio', 'Engine cache hits / lookups',
+                   [({'cache': name}, round(cache.hits / (cache.hits + cache.misses), 4)
+                     if cache.hits + cache.misses else 0) for name, cache in caches])
+
+    rss = process_rss_bytes()
+    if rss is not None:
+        lines += gauge('xtts_process_resident_memory_bytes', 'Resident memory of the server process',
+                       [({}, rss)])
+    lines += gauge('xtts_process_uptime_seconds', 'Seconds since the engine was created',
+                   [({}, round(time.monotonic() - engine.created, 1))])
+    return lines
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime backend for the XTTS v2 engine
+
+Runs the autoregressive GPT sampling loop (with explicit KV-cache inputs)
+and the HiFi-GAN decoder as exported ONNX graphs on ONNX Runtime's CPU
+execution provider. Tokenization, speaker conditioning and the single
+GPT latent pass stay in PyTorch.
+
+Usage:
+    python xtts_onnx.py export [--out DIR]     # export graphs from the PyTorch model
+    python xtts_onnx.py parity [--onnx-dir DIR] # compare ONNX vs PyTorch outputs
+
+Serve with:
+    XTTS_BACKEND=onnx python xtts_server.py
+
+Environment:
+  XTTS_ONNX_DIR      - exported graph directory (default: cache/xtts_onnx)
+  XTTS_ONNX_THREADS  - intra-op threads for ONNX Runtime (default: all cores)
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from xtts_engine import XTTSEngine
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ONNX_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'xtts_onnx'
+)
+
+GPT_FILE = 'gpt_step.onnx'
+DECODER_FILE = 'hifigan_decoder.onnx'
+MANIFEST_FILE = 'manifest.json'
+
+# ============================================================================
+# EXPORT WRAPPERS
+# ============================================================================
+
+class GPTStep(nn.Module):
+    """One GPT forward over new embeddings given stacked past keys/values"""
+
+    def __init__(self, gpt_inference):
+        super().__init__()
+        self.transformer = gpt_inference.transformer
+        self.lm_head = gpt_inference.lm_head
+
+    def forward(self, inputs_embeds, past_keys, past_values):
+        past = tuple((past_keys[i], past_values[i]) for i in range(past_keys.shape[0]))
+        out = self.transformer(
+            inputs_embeds=inputs_embeds,
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True,
+        )
+        logits = self.lm_head(out.last_hidden_state[:, -1:])
+        present_keys = torch.stack([k for k, _ in out.past_key_values])
+        present_values = torch.stack([v for _, v in out.past_key_values])
+        return logits, present_keys, present_values
+
+
+class DecoderGraph(nn.Module):
+    """HiFi-GAN decoder with a positional speaker embedding argument"""
+
+    def __init__(self, hifigan_decoder):
+        super().__init__()
+        self.decoder = hifigan_decoder
+
+    def forward(self, latents, speaker_embedding):
+        return self.decoder(latents, g=speaker_embedding)
+
+
+def _gpt_dims(model):
+    gpt_config = model.gpt.gpt_inference.transformer.config
+    return {
+        'layers': gpt_config.n_layer,
+        'heads': gpt_config.n_head,
+        'head_dim': gpt_config.n_embd // gpt_config.n_head,
+        'model_dim': gpt_config.n_embd,
+    }
+
+
+def _empty_past(dims, length=0):
+    shape = (dims['layers'], 1, dims['heads'], length, dims['head_dim'])
+    return np.zeros(shape, dtype=np.float32)
+
+
+def export(model, out_dir, opset=17):
+    """Export the GPT step and decoder graphs plus the embedding tables they need"""
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.float().cpu().eval()
+    gpt = model.gpt
+    dims = _gpt_dims(model)
+
+    logger.info(f"Exporting GPT step graph ({dims['layers']} layers)...")
+    step = GPTStep(gpt.gpt_inference).eval()
+    example = (
+        torch.zeros(1, 4, dims['model_dim']),
+        torch.from_numpy(_empty_past(dims, length=1)),
+        torch.from_numpy(_empty_past(dims, length=1)),
+    )
+    with torch.no_grad():
+        torch.onnx.export(
+            step, example, os.path.join(out_dir, GPT_FILE),
+            input_names=['inputs_embeds', 'past_keys', 'past_values'],
+            output_names=['logits', 'present_keys', 'present_values'],
+            dynamic_axes={
+                'inputs_embeds': {1: 'sequence'},
+                'past_keys': {3: 'past'},
+                'past_values': {3: 'past'},
+                'present_keys': {3: 'total'},
+                'present_values': {3: 'total'},
+            },
+            opset_version=opset,
+        )
+
+    logger.info("Exporting HiFi-GAN decoder graph...")
+    decoder = DecoderGraph(model.hifigan_decoder).eval()
+    example = (
+        torch.zeros(1, 64, model.args.gpt_n_model_channels),
+        torch.zeros(1, model.args.d_vector_dim, 1),
+    )
+    with torch.no_grad():
+        torch.onnx.export(
+            decoder, example, os.path.join(out_dir, DECODER_FILE),
+            input_names=['latents', 'speaker_embedding'],
+            output_names=['wav'],
+            dynamic_axes={'latents': {1: 'frames'}, 'wav': {2: 'samples'}},
+            opset_version=opset,
+        )
+
+    # Audio-token embeddings are looked up in numpy during the sampling loop
+    np.save(os.path.join(out_dir, 'mel_embedding.npy'),
+            gpt.mel_embedding.weight.detach().numpy())
+    np.save(os.path.join(out_dir, 'mel_pos_embedding.npy'),
+            gpt.mel_pos_embedding.emb.weight.detach().numpy())
+
+    manifest = {
+        'torch_version': torch.__version__,
+        'opset': opset,
+        **dims,
+        'start_audio_token': gpt.start_audio_token,
+        'stop_audio_token': gpt.stop_audio_token,
+        'max_gen_mel_tokens': gpt.max_gen_mel_tokens,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f" ONNX graphs exported to {out_dir}")
+    return manifest
+
+# ============================================================================
+# SAMPLING
+# ============================================================================
+
+def _softmax(x):
+    x = x - np.max(x)
+    e = np.exp(x)
+    return e / e.sum()
+
+
+def sample_token(logits, generated, temperature, top_k, top_p, repetition_penalty, rng):
+    """Same processor order as transformers' generate(): penalty, temperature, top-k, top-p"""
+    logits = logits.astype(np.float64)
+
+    if repetition_penalty != 1.0 and generated:
+        seen = np.unique(generated)
+        score = logits[seen]
+        logits[seen] = np.where(score < 0, score * repetition_penalty, score / repetition_penalty)
+
+    logits = logits / max(temperature, 1e-5)
+
+    if 0 < top_k < logits.size:
+        kth = np.partition(logits, -top_k)[-top_k]
+        logits[logits < kth] = -np.inf
+
+    if top_p < 1.0:
+        order = np.argsort(logits)[::-1]
+        probs = _softmax(logits[order])
+        # Drop tokens once the mass before them already covers top_p (always keep one)
+        remove = (np.cumsum(probs) - probs) > top_p
+        logits[order[remove]] = -np.inf
+
+    return int(rng.choice(logits.size, p=_softmax(logits)))
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+class ONNXEngine(XTTSEngine):
+    """XTTS engine running GPT sampling and the decoder under ONNX Runtime (CPU)"""
+
+    backend = 'onnx'
+
+    def __init__(self, onnx_dir=None, **kwargs):
+        kwargs['device'] = 'cpu'
+        kwargs['precision'] = 'fp32'
+        super().__init__(**kwargs)
+        self.onnx_dir = onnx_dir or os.getenv('XTTS_ONNX_DIR', DEFAULT_ONNX_DIR)
+        self.manifest = None
+        self._gpt_session = None
+        self._decoder_session = None
+        self._rng = np.random.default_rng()
+
+    def _prepare_stages(self):
+        self._prepare_budget()
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed (pip install onnxruntime)")
+
+        manifest_path = os.path.join(self.onnx_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise RuntimeError(
+                f"No exported graphs in {self.onnx_dir} - run: python xtts_onnx.py export"
+            )
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.getenv('XTTS_ONNX_THREADS', 0))
+        if threads:
+            options.intra_op_num_threads = threads
+
+        providers = ['CPUExecutionProvider']
+        self._gpt_session = ort.InferenceSession(
+            os.path.join(self.onnx_dir, GPT_FILE), options, providers=providers
+        )
+        self._decoder_session = ort.InferenceSession(
+            os.path.join(self.onnx_dir, DECODER_FILE), options, providers=providers
+        )
+        self._mel_embedding = np.load(os.path.join(self.onnx_dir, 'mel_embedding.npy'))
+        self._mel_pos_embedding = np.load(os.path.join(self.onnx_dir, 'mel_pos_embedding.npy'))
+        logger.info(f" ONNX Runtime sessions ready ({self.onnx_dir})")
+
+    def unload(self):
+        self._gpt_session = self._decoder_session = None
+        super().unload()
+
+    def info(self):
+        info = super().info()
+        info['onnx'] = {
+            'dir': self.onnx_dir,
+            'onnxruntime_version': ort.__version__ if ort else None,
+            'manifest': self.manifest,
+        }
+        return info
+
+    def _text_embeddings(self, text_tokens):
+        """Text embeddings, exactly as GPT.compute_embeddings builds them"""
+        gpt = self.model.gpt
+        text_inputs = F.pad(text_tokens, (0, 1), value=gpt.stop_text_token)
+        text_inputs = F.pad(text_inputs, (1, 0), value=gpt.start_text_token)
+        emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+        return emb.float().numpy()
+
+    def _prefix_embeddings(self, text_tokens, gpt_cond_latent):
+        """Conditioning + text embeddings (the full GPT prefix)"""
+        return np.concatenate(
+            [gpt_cond_latent.float().numpy(), self._text_embeddings(text_tokens)], axis=1
+        )
+
+    def _conditioning_past(self, gpt_cond_latent):
+        """Key/value state after running only the conditioning latents"""
+        _, keys, values = self._gpt_session.run(None, {
+            'inputs_embeds': gpt_cond_latent.float().numpy(),
+            'past_keys': _empty_past(self.manifest),
+            'past_values': _empty_past(self.manifest),
+        })
+        return keys, values
+
+    def _audio_embedding(self, token, position):
+        return (self._mel_embedding[token] + self._mel_pos_embedding[position])[None, None, :]
+
+    def _generate_codes(self, text_tokens, gpt_cond_latent, settings, prefix_key=None,
+                        max_new_tokens=None):
+        manifest = self.manifest
+        max_new_tokens = max_new_tokens or manifest['max_gen_mel_tokens']
+        start, stop = manifest['start_audio_token'], manifest['stop_audio_token']
+
+        if self.prefix_cache is not None and prefix_key is not None:
+            past_keys, past_values = self.prefix_cache.get_or_compute(
+                (prefix_key, 'onnx'), lambda: self._conditioning_past(gpt_cond_latent)
+            )
+            prefix = self._text_embeddings(text_tokens)
+        else:
+            past_keys = past_values = _empty_past(manifest)
+            prefix = self._prefix_embeddings(text_tokens, gpt_cond_latent)
+
+        inputs = np.concatenate([prefix, self._audio_embedding(start, 0)], axis=1).astype(np.float32)
+
+        generated = [start]
+        codes = []
+        for position in range(1, max_new_tokens + 1):
+            logits, past_keys, past_values = self._gpt_session.run(None, {
+                'inputs_embeds': inputs,
+                'past_keys': past_keys,
+                'past_values': past_values,
+            })
+            token = sample_token(
+                logits[0, -1], generated,
+                temperature=settings['temperature'],
+                top_k=settings['top_k'],
+                top_p=settings['top_p'],
+                repetition_penalty=settings['repetition_penalty'],
+                rng=self._rng,
+            )
+            codes.append(token)
+            generated.append(token)
+            if token == stop:
+                break
+            inputs = self._audio_embedding(token, position).astype(np.float32)
+
+        return torch.tensor([codes], dtype=torch.long)
+
+    def _decode(self, gpt_latents, speaker_embedding):
+        wav, = self._decoder_session.run(None, {
+            'latents': gpt_latents.float().numpy(),
+            'speaker_embedding': speaker_embedding.float().numpy(),
+        })
+        return torch.from_numpy(wav)
+
+# ============================================================================
+# PARITY CHECK
+# ============================================================================
+
+def parity(engine, onnx_engine, steps=32, tolerance=1e-3):
+    """Compare ONNX graphs against the PyTorch modules on identical inputs"""
+    model = engine.model
+    gpt_cond_latent, speaker_embedding = engine.get_conditioning_latents()
+    text_tokens = engine._tokenize("The quick brown fox jumps over the lazy dog.", 'en')
+    report = {}
+
+    with torch.inference_mode():
+        # Decoder: same latents through both implementations
+        latents = torch.randn(1, 96, model.args.gpt_n_model_channels) * 0.5
+        torch_wav = model.hifigan_decoder(latents, g=speaker_embedding).squeeze().numpy()
+        onnx_wav = onnx_engine._decode(latents, speaker_embedding).squeeze().numpy()
+        report['decoder_max_abs_diff'] = float(np.max(np.abs(torch_wav - onnx_wav)))
+
+        # GPT: greedy decode the same prefix step by step in both
+        step = GPTStep(model.gpt.gpt_inference).eval()
+        manifest = onnx_engine.manifest
+        inputs = np.concatenate([
+            onnx_engine._prefix_embeddings(text_tokens, gpt_cond_latent),
+            onnx_engine._audio_embedding(manifest['start_audio_token'], 0),
+        ], axis=1).astype(np.float32)
+        torch_past = (torch.from_numpy(_empty_past(manifest)),) * 2
+        onnx_past = (_empty_past(manifest),) * 2
+
+        max_diff, mismatches = 0.0, 0
+        for position in range(1, steps + 1):
+            torch_logits, *torch_past = step(torch.from_numpy(inputs), *torch_past)
+            onnx_logits, *onnx_past = onnx_engine._gpt_session.run(None, {
+                'inputs_embeds': inputs, 'past_keys': onnx_past[0], 'past_values': onnx_past[1],
+            })
+            torch_logits = torch_logits.numpy()[0, -1]
+            max_diff = max(max_diff, float(np.max(np.abs(torch_logits - onnx_logits[0, -1]))))
+
+            token = int(np.argmax(torch_logits))
+            mismatches += int(token != int(np.argmax(onnx_logits[0, -1])))
+            if token == manifest['stop_audio_token']:
+                break
+            inputs = onnx_engine._audio_embedding(token, position).astype(np.float32)
+
+        report['gpt_max_abs_logit_diff'] = max_diff
+        report['gpt_greedy_token_mismatches'] = mismatches
+
+    report['passed'] = (
+        report['decoder_max_abs_diff'] <= tolerance
+        and report['gpt_max_abs_logit_diff'] <= tolerance * 10
+        and mismatches == 0
+    )
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="XTTS v2 ONNX export / parity tool")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export_cmd = sub.add_parser('export', help="export ONNX graphs from the PyTorch model")
+    export_cmd.add_argument('--out', default=os.getenv('XTTS_ONNX_DIR', DEFAULT_ONNX_DIR))
+    export_cmd.add_argument('--opset', type=int, default=17)
+
+    parity_cmd = sub.add_parser('parity', help="compare ONNX and PyTorch outputs")
+    parity_cmd.add_argument('--onnx-dir', default=os.getenv('XTTS_ONNX_DIR', DEFAULT_ONNX_DIR))
+    parity_cmd.add_argument('--tolerance', type=float, default=1e-3)
+
+    args = parser.parse_args()
+
+    engine = XTTSEngine(device='cpu', precision='fp32')
+    engine._download_model()
+    engine._load_model()
+
+    if args.command == 'export':
+        export(engine.model, args.out, opset=args.opset)
+        return 0
+
+    onnx_engine = ONNXEngine(onnx_dir=args.onnx_dir)
+    onnx_engine.model, onnx_engine.config = engine.model, engine.config
+    onnx_engine._prepare_stages()
+
+    report = parity(engine, onnx_engine, tolerance=args.tolerance)
+    print(json.dumps(report, indent=2))
+    return 0 if report['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
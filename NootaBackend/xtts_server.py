@@ -7,13 +7,23 @@ pip install TTS torch flask flask-cors python-dotenv
 """
 
 import os
-import io
+import json
+import math
+import uuid
+import base64
 import torch
 import logging
-from flask import Flask, request, send_file, jsonify
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from TTS.api import TTS
 from dotenv import load_dotenv
+from xtts_engine import create_engine
+from xtts_audio import (
+    FORMATS, AudioEncoder, check_storage_extension, negotiate_output, resolve_output, stitch, store_audio
+)
+from xtts_http import serve, health_routes, limit_request_bodies, metrics_routes, raw_body, read_upload
+from xtts_grpc import start_grpc_server
+from xtts_swap import EngineSlot, admin_routes, serve_engine_slot
 
 load_dotenv()
 
@@ -23,26 +33,111 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+limit_request_bodies(app)
 
-# Initialize XTTS model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-logger.info(f"Using device: {device}")
-logger.info("Loading XTTS v2 model (this may take a minute on first run)...")
+# Initialize XTTS engine and the response encoder pool. Requests see the
+# engine they were pinned to, so a hot swap (POST /admin/engine/reload)
+# never changes it under a running request
+engines = EngineSlot(create_engine())
+engine = serve_engine_slot(app, engines)
+encoder = AudioEncoder()
+logger.info(f"Using device: {engine.device} (backend: {engine.backend}, precision: {engine.precision})")
+logger.info("Loading XTTS v2 model in the background (this may take a minute on first run)...")
 
-try:
-    tts = TTS("tts_models/multilingual/multi_speaker/xtts_v2", gpu=(device == "cuda"))
-    logger.info(" XTTS v2 model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load XTTS model: {e}")
-    tts = None
+# The server binds right away; /health reports the loading stage meanwhile
+engine.load_in_background()
+health_routes(app, engine)
+admin_routes(app, engines)
+metrics_routes(app, engine, engines)
+
+# Direct-to-storage output: requests with a storage_key are written here
+# instead of being sent back (usually the Node backend's uploads/audio/chunks)
+STORAGE_DIR = os.getenv('XTTS_STORAGE_DIR')
+
+# Longest crossfade between message chunks; longer ones would swallow short chunks
+MAX_CROSSFADE_MS = 1000
+
+# JSON stays first so "*/*" keeps the base64 response
+BATCH_RESPONSE_TYPES = ['application/json', 'multipart/mixed']
+
+def read_request():
+    """Request fields and optional reference audio bytes from any supported body
+
+    - application/json: fields in the body, reference as ref_audio_base64
+    - multipart/form-data: form fields, reference as a ref_audio (or speaker_wav) file part
+    - audio/* or application/octet-stream: the body is the reference, fields in the query string
+    """
+    if request.is_json:
+        data = request.get_json() or {}
+        ref_audio_base64 = data.get('ref_audio_base64')
+        return data, base64.b64decode(ref_audio_base64) if ref_audio_base64 else None
+
+    data = request.args.to_dict()
+    if request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+        return data, raw_body() or None
+
+    data.update(request.form.to_dict())
+    upload = request.files.get('ref_audio') or request.files.get('speaker_wav')
+    return data, read_upload(upload)
+
+def add_stats_headers(response, stats):
+    """Expose generation stats (token budget hits) on an audio response"""
+    response.headers['X-Audio-Tokens'] = str(stats['audio_tokens'])
+    response.headers['X-Token-Budget'] = str(stats['token_budget'])
+    response.headers['X-Token-Budget-Hit'] = 'true' if stats['truncated_sentences'] else 'false'
+    return response
+
+def negotiate_result(data):
+    """negotiate_output() for the request, refusing a storage_key for another format"""
+    output = negotiate_output(request, data)
+    if data.get('storage_key'):
+        check_storage_extension(data['storage_key'], output.format)
+    return output
+
+def audio_result(wav, output, stats, data, download_name='output.wav', headers=None, extra=None):
+    """Audio response, or with a storage_key the file is stored and only metadata is returned
+
+    headers are added to the audio response, extra fields to the metadata.
+    """
+    storage_key = data.get('storage_key')
+    if not storage_key:
+        response = encoder.response(wav, engine.sample_rate, output, download_name=download_name)
+        response.headers.update(headers or {})
+        return add_stats_headers(response, stats)
+
+    if not STORAGE_DIR:
+        return jsonify({'error': 'Direct-to-storage output is not configured (XTTS_STORAGE_DIR)'}), 400
+
+    audio_data, encode_time, output_rate = encoder.encode(wav, engine.sample_rate, output)
+    try:
+        store_audio(STORAGE_DIR, storage_key, audio_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    logger.info(f" Stored {len(audio_data)} bytes as {storage_key}")
+    return jsonify({
+        'storage_key': storage_key,
+        'bytes': len(audio_data),
+        'format': output.format,
+        'sample_rate': output_rate,
+        'duration': round(len(wav) / engine.sample_rate, 3),
+        'encode_ms': round(encode_time * 1000, 1),
+        'audio_tokens': stats['audio_tokens'],
+        'token_budget_hit': stats['truncated_sentences'] > 0,
+        **(extra or {})
+    })
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (always 200; see /health/ready for readiness)"""
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if engine.ready else ('error' if engine.state == 'failed' else 'loading'),
+        'startup': engine.load_status(),
+        'engine': engines.status(),
         'model': 'XTTS v2',
-        'device': device,
+        'device': engine.device,
+        'backend': engine.backend,
+        'precision': engine.precision,
         'cuda_available': torch.cuda.is_available()
     })
 
@@ -70,21 +165,28 @@ def synthesize():
         "language": "en",
         "speaker": "user",
         "ref_audio_base64": "base64_encoded_wav_audio_optional",
+        "format": "wav | opus | flac | mp3 (optional, else Accept header)",
+        "sample_rate": "8000 | 16000 | 22050 | 24000 (optional, default 24000)",
+        "sample_format": "pcm16 | float32 (optional, wav only)",
+        "storage_key": "chunks/en_msg_chunk0.wav (optional, store instead of returning audio)",
         "temperature": 0.75,
         "speed": 1.0,
         "top_p": 0.85,
         "top_k": 50
     }
+
+    The same fields can be sent as multipart/form-data with the reference as
+    a `ref_audio` file part, or as query parameters with the raw reference
+    audio as the body (Content-Type audio/* or application/octet-stream).
     """
     try:
-        if not tts:
+        if not engine.ready:
             return jsonify({'error': 'TTS model not loaded'}), 503
 
-        data = request.get_json()
+        data, ref_audio = read_request()
         text = data.get('text', '').strip()
         language = data.get('language', 'en')
         speaker = data.get('speaker', 'default')
-        ref_audio_base64 = data.get('ref_audio_base64')
         
         # Optional parameters
         temperature = data.get('temperature', 0.75)
@@ -95,66 +197,262 @@ def synthesize():
         if not text:
             return jsonify({'error': 'Text is required'}), 400
 
+        try:
+            output = negotiate_result(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         logger.info(f"Synthesizing: language={language}, speaker={speaker}, text_length={len(text)}")
 
-        # Handle voice cloning with reference audio
-        if ref_audio_base64:
-            import base64
-            import tempfile
-            
-            # Decode base64 audio
-            audio_bytes = base64.b64decode(ref_audio_base64)
-            
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-                tmp.write(audio_bytes)
-                ref_audio_path = tmp.name
-            
+        # Handle voice cloning with reference audio (decoded in memory)
+        if ref_audio:
+            logger.info(f"Using reference audio for voice cloning")
+
+        wav, stats = engine.synthesize(
+            text=text,
+            language=language,
+            speaker_wav=ref_audio,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            speed=speed,
+            return_stats=True
+        )
+
+        logger.info(f" Speech synthesis completed for {language}")
+
+        return audio_result(wav, output, stats, data, download_name=f'tts_{language}.wav')
+
+    except Exception as e:
+        logger.error(f"TTS Error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/synthesize', methods=['POST'])
+def synthesize_form():
+    """
+    Generate speech - contract used by the Node backend (xttsService.js)
+
+    POST /api/synthesize  (multipart/form-data or JSON)
+        text, language, speaker_wav (optional WAV/FLAC/M4A/Opus/MP3 file for voice cloning),
+        format (optional wav | opus | flac | mp3, else negotiated from Accept),
+        sample_rate (optional 8000 | 16000 | 22050 | 24000), sample_format (optional pcm16 | float32),
+        storage_key (optional, write the file under XTTS_STORAGE_DIR instead of returning it)
+
+    Returns: audio file (WAV unless another format was requested), or JSON
+    metadata when storage_key was given
+    """
+    try:
+        if not engine.ready:
+            return jsonify({'error': 'Model not ready'}), 503
+
+        data = {}
+        if request.is_json:
+            data = request.get_json() or {}
+        if request.form:
+            data.update(request.form.to_dict())
+
+        text = data.get('text', '').strip()
+        language = data.get('language', 'en')
+
+        if not text:
+            return jsonify({'error': 'No text'}), 400
+
+        try:
+            output = negotiate_result(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        logger.info(f"Synthesizing: language={language}, text_length={len(text)}")
+
+        ref_audio = None
+        if 'speaker_wav' in request.files:
+            ref_audio = read_upload(request.files['speaker_wav'])
+
+        wav, stats = engine.synthesize(
+            text=text, language=language, speaker_wav=ref_audio, return_stats=True
+        )
+
+        return audio_result(wav, output, stats, data)
+
+    except Exception as e:
+        logger.error(f"Synthesis error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tts/message', methods=['POST'])
+def synthesize_message():
+    """
+    Synthesize a whole message as one stitched audio file
+
+    POST /api/tts/message
+    {
+        "text": "Whole message...",          (segmented on the server)
+        "chunks": ["First part.", "..."],    (or pre-split chunks, kept as given)
+        "language": "ar",
+        "ref_audio_base64": "base64_optional",
+        "crossfade_ms": 20,
+        "trim_silence": true,
+        "format": "wav | opus | flac | mp3 (optional, else Accept header)",
+        "storage_key": "optional, as for /api/tts"
+    }
+
+    Accepts the same multipart/raw bodies as /api/tts. Returns one audio file;
+    X-Chunk-Offsets holds [start, end] seconds of every chunk in it.
+    """
+    try:
+        if not engine.ready:
+            return jsonify({'error': 'TTS model not loaded'}), 503
+
+        data, ref_audio = read_request()
+        language = data.get('language', 'en')
+        chunks = data.get('chunks')
+        if isinstance(chunks, str):
+            # Form and query fields carry the list as a JSON string
             try:
-                # Generate speech with voice cloning
-                logger.info(f"Using reference audio for voice cloning")
-                wav = tts.tts_with_vc(
-                    text=text,
-                    language_idx=language,
-                    speaker_wav=ref_audio_path,
-                    temperature=temperature,
-                    top_p=top_p,
-                    top_k=top_k,
-                    speed=speed
-                )
-            finally:
-                # Clean up temporary file
-                if os.path.exists(ref_audio_path):
-                    os.remove(ref_audio_path)
+                chunks = json.loads(chunks)
+            except ValueError:
+                return jsonify({'error': 'chunks must be a JSON list of strings'}), 400
+        if chunks:
+            if not isinstance(chunks, list) or not all(isinstance(c, str) and c.strip() for c in chunks):
+                return jsonify({'error': 'chunks must be a list of non-empty strings'}), 400
+            chunks = [c.strip() for c in chunks]
         else:
-            # Generate speech without voice cloning
-            wav = tts.tts(
-                text=text,
-                language_idx=language,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                speed=speed
-            )
+            text = data.get('text', '').strip()
+            chunks = engine.segment(text, language) if text else []
 
-        # Convert to audio buffer
-        audio_buffer = io.BytesIO()
-        tts.save_wav(wav, audio_buffer)
-        audio_buffer.seek(0)
+        if not chunks:
+            return jsonify({'error': 'Text is required'}), 400
 
-        logger.info(f" Speech synthesis completed for {language}")
+        try:
+            output = negotiate_result(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            crossfade_ms = float(data.get('crossfade_ms', 20))
+        except (TypeError, ValueError):
+            crossfade_ms = None
+        if crossfade_ms is None or not math.isfinite(crossfade_ms) or not 0 <= crossfade_ms <= MAX_CROSSFADE_MS:
+            return jsonify({'error': f'crossfade_ms must be a number from 0 to {MAX_CROSSFADE_MS}'}), 400
+        trim = str(data.get('trim_silence', True)).lower() not in ('false', '0', 'no')
+
+        logger.info(f"Message synthesis: language={language}, chunks={len(chunks)}")
+
+        wavs, stats = engine.synthesize_chunks(chunks, language=language, speaker_wav=ref_audio)
+        wav, offsets = stitch(wavs, engine.sample_rate, crossfade_ms=crossfade_ms, trim=trim)
 
-        return send_file(
-            audio_buffer,
-            mimetype='audio/wav',
-            as_attachment=True,
-            download_name=f'tts_{language}.wav'
+        chunk_offsets = [[round(start, 3), round(end, 3)] for start, end in offsets]
+        return audio_result(
+            wav, output, stats, data,
+            download_name=f'message_{language}.wav',
+            headers={'X-Chunk-Count': str(len(chunks)), 'X-Chunk-Offsets': json.dumps(chunk_offsets)},
+            extra={'chunk_count': len(chunks), 'chunk_offsets': chunk_offsets}
         )
 
     except Exception as e:
-        logger.error(f"TTS Error: {e}", exc_info=True)
+        logger.error(f"Message synthesis error: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/segment', methods=['POST'])
+def segment():
+    """
+    Preview how the server will segment a message for synthesis
+
+    POST /api/segment
+    {
+        "text": "Whole message...",
+        "language": "ar"
+    }
+    """
+    try:
+        if not engine.ready:
+            return jsonify({'error': 'Model not ready'}), 503
+
+        data = request.get_json() or {}
+        text = data.get('text', '').strip()
+        language = data.get('language', 'en')
+
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+
+        segments = engine.segment(text, language)
+        return jsonify({
+            'language': language,
+            'segments': segments,
+            'total': len(segments)
+        })
+
+    except Exception as e:
+        logger.error(f"Segmentation error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+def batch_results(text, languages, ref_audio, output):
+    """Yield (language, result, audio bytes or None) in request order
+
+    Each language is encoded in the background while the next one is generated.
+    """
+    pending = None
+    for language in languages:
+        try:
+            wav, stats = engine.synthesize(
+                text=text,
+                language=language,
+                speaker_wav=ref_audio,
+                return_stats=True
+            )
+            future = encoder.submit(wav, engine.sample_rate, output)
+        except Exception as e:
+            logger.error(f"Error synthesizing {language}: {e}")
+            future, stats = Future(), None
+            future.set_exception(e)
+
+        if pending:
+            yield collect_result(*pending, output)
+        pending = (language, future, stats)
+
+    if pending:
+        yield collect_result(*pending, output)
+
+def collect_result(language, future, stats, output):
+    try:
+        audio_data, _, output_rate = future.result()
+    except Exception as e:
+        return language, {'status': 'failed', 'error': str(e)}, None
+
+    logger.info(f" Generated audio for {language}")
+    return language, {
+        'status': 'completed',
+        'format': output.format,
+        'sample_rate': output_rate,
+        'audio_tokens': stats['audio_tokens'],
+        'token_budget_hit': stats['truncated_sentences'] > 0
+    }, audio_data
+
+def multipart_batch(results, output):
+    """Stream batch results as multipart/mixed, one part per language as it finishes"""
+    boundary = uuid.uuid4().hex
+
+    def generate():
+        for language, result, audio_data in results:
+            headers = {'Content-Language': language, 'X-Status': result['status']}
+            if audio_data is None:
+                body = json.dumps(result).encode()
+                headers['Content-Type'] = 'application/json'
+            else:
+                body = audio_data
+                headers['Content-Type'] = FORMATS[output.format].mimetype
+                headers['X-Sample-Rate'] = str(result['sample_rate'])
+                headers['X-Audio-Tokens'] = str(result['audio_tokens'])
+                headers['X-Token-Budget-Hit'] = 'true' if result['token_budget_hit'] else 'false'
+            headers['Content-Length'] = str(len(body))
+
+            head = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+            yield f'--{boundary}\r\n{head}\r\n'.encode() + body + b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+
+    return Response(
+        stream_with_context(generate()),
+        content_type=f'multipart/mixed; boundary={boundary}'
+    )
+
 @app.route('/api/tts/batch', methods=['POST'])
 def synthesize_batch():
     """
@@ -164,73 +462,52 @@ def synthesize_batch():
     {
         "text": "Hello",
         "languages": ["en", "ar", "es"],
-        "ref_audio_base64": "base64_optional"
+        "ref_audio_base64": "base64_optional",
+        "format": "wav | opus | flac | mp3 (optional, default wav)",
+        "sample_rate": 16000,
+        "sample_format": "pcm16"
     }
+
+    Requests may also be multipart/form-data or raw reference audio, as for
+    /api/tts (languages as "en,ar,es"). With "Accept: multipart/mixed" the
+    audio comes back as one binary part per language instead of base64 JSON.
     """
     try:
-        if not tts:
+        if not engine.ready:
             return jsonify({'error': 'TTS model not loaded'}), 503
 
-        data = request.get_json()
+        data, ref_audio = read_request()
         text = data.get('text', '').strip()
         languages = data.get('languages', ['en'])
-        ref_audio_base64 = data.get('ref_audio_base64')
+        if isinstance(languages, str):
+            languages = [l.strip() for l in languages.split(',') if l.strip()]
 
         if not text:
             return jsonify({'error': 'Text is required'}), 400
 
+        try:
+            # Accept picks the response container, so the audio format is explicit
+            output = resolve_output(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         logger.info(f"Batch synthesis: {len(languages)} languages")
 
-        results = {}
-        
-        for language in languages:
-            try:
-                if ref_audio_base64:
-                    import base64
-                    import tempfile
-                    
-                    audio_bytes = base64.b64decode(ref_audio_base64)
-                    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-                        tmp.write(audio_bytes)
-                        ref_audio_path = tmp.name
-                    
-                    try:
-                        wav = tts.tts_with_vc(
-                            text=text,
-                            language_idx=language,
-                            speaker_wav=ref_audio_path
-                        )
-                    finally:
-                        if os.path.exists(ref_audio_path):
-                            os.remove(ref_audio_path)
-                else:
-                    wav = tts.tts(text=text, language_idx=language)
-
-                # Convert to WAV buffer
-                buffer = io.BytesIO()
-                tts.save_wav(wav, buffer)
-                buffer.seek(0)
-                audio_data = buffer.getvalue()
-                
+        results = batch_results(text, languages, ref_audio, output)
+        if request.accept_mimetypes.best_match(BATCH_RESPONSE_TYPES) == 'multipart/mixed':
+            return multipart_batch(results, output)
+
+        languages_json = {}
+        for language, result, audio_data in results:
+            if audio_data is not None:
                 # Encode to base64 for JSON response
-                import base64
-                results[language] = {
-                    'status': 'completed',
-                    'audio_base64': base64.b64encode(audio_data).decode()
-                }
-                logger.info(f" Generated audio for {language}")
-
-            except Exception as e:
-                logger.error(f"Error synthesizing {language}: {e}")
-                results[language] = {
-                    'status': 'failed',
-                    'error': str(e)
-                }
+                result['audio_base64'] = base64.b64encode(audio_data).decode()
+            languages_json[language] = result
 
         return jsonify({
             'success': True,
             'text': text,
-            'languages': results
+            'languages': languages_json
         })
 
     except Exception as e:
@@ -243,9 +520,11 @@ def model_info():
     return jsonify({
         'model': 'XTTS v2',
         'provider': 'Coqui TTS',
-        'device': device,
+        'device': engine.device,
         'cuda_available': torch.cuda.is_available(),
         'torch_version': torch.__version__,
+        **engine.info(),
+        'encoder': encoder.info(),
         'supported_languages': [
             'en', 'ar', 'es', 'fr', 'de', 'it', 'pt',
             'ja', 'zh', 'ko', 'ru', 'pl', 'nl', 'tr',
@@ -264,4 +543,5 @@ def internal_error(error):
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
     logger.info(f" Starting Noota XTTS Server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    grpc_server = start_grpc_server(engines, encoder)
+    serve(app, port=port)
@@ -10,10 +10,6 @@ import json
 import logging
 from pathlib import Path
 
-# Auto-agree to XTTS license (non-commercial CPML)
-os.environ['TTS_HOME'] = '/tmp/tts_model_cache'
-os.makedirs(os.environ['TTS_HOME'], exist_ok=True)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -28,10 +24,11 @@ print("="*60 + "\n")
 try:
     print("1. Importing libraries...")
     import torch
-    from TTS.api import TTS
-    from flask import Flask, request, jsonify, send_file
+    from flask import Flask, request, jsonify
     from flask_cors import CORS
-    import io
+    from xtts_engine import XTTSEngine
+    from xtts_audio import AudioEncoder, check_storage_extension, negotiate_output, store_audio
+    from xtts_http import serve, health_routes, limit_request_bodies, metrics_routes, read_upload
     print("    All imports successful\n")
 except ImportError as e:
     print(f"   Import error: {e}")
@@ -42,29 +39,31 @@ except ImportError as e:
 # Initialize Flask
 app = Flask(__name__)
 CORS(app)
+limit_request_bodies(app)
 
 # Initialize XTTS model
 print("2. Loading XTTS v2 model...")
 print("    First time takes 2-5 minutes...\n")
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+engine = XTTSEngine()
+encoder = AudioEncoder()
+device = engine.device
 logger.info(f"🖥️  Using device: {device}")
 
-try:
-    # This is the EXACT code from your Kaggle notebook
-    torch.serialization.safe_load = lambda *args, **kwargs: torch.load(*args, **kwargs, weights_only=False)
-    
-    # Auto-agree to license prompt by setting environment variable
-    os.environ['TTS_PLUGINS'] = '/tmp/.tts_plugins'
-    
-    # Load model
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True, gpu=torch.cuda.is_available()).to(device)
-    
-    logger.info(" XTTS v2 model loaded successfully!")
-    TTS_READY = True
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    TTS_READY = False
+# This is the EXACT code from your Kaggle notebook
+torch.serialization.safe_load = lambda *args, **kwargs: torch.load(*args, **kwargs, weights_only=False)
+
+# Auto-agree to license prompt by setting environment variable
+os.environ['TTS_PLUGINS'] = '/tmp/.tts_plugins'
+
+# Load model in the background so /health answers while it loads
+engine.load_in_background()
+health_routes(app, engine)
+metrics_routes(app, engine)
+
+# Direct-to-storage output, as in xtts_server.py: requests with a storage_key
+# are written here instead of being sent back
+STORAGE_DIR = os.getenv('XTTS_STORAGE_DIR')
 
 print("\n" + "="*60)
 print("🌐 Flask API Endpoints")
@@ -73,14 +72,14 @@ print("="*60 + "\n")
 # Endpoints
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ready' if TTS_READY else 'error', 'model': 'xtts_v2'})
+    return jsonify({'status': engine.state, 'startup': engine.load_status(), 'model': 'xtts_v2'})
 
 @app.route('/api/synthesize', methods=['POST'])
 def synthesize():
     """Synthesize speech - supports both JSON and multipart/form-data"""
     
-    if not TTS_READY:
-        return jsonify({'error': 'Model not ready'}), 503
+    if not engine.ready:
+        return jsonify({'error': 'Model not ready', 'state': engine.state}), 503
     
     try:
         # Support both JSON and form data - don't error on Content-Type
@@ -92,50 +91,50 @@ def synthesize():
         
         text = data.get('text', '')
         language = data.get('language', 'en')
+        storage_key = data.get('storage_key')
         speaker_wav = None
         
         if not text:
             return jsonify({'error': 'No text'}), 400
+        if storage_key and not STORAGE_DIR:
+            return jsonify({'error': 'Direct-to-storage output is not configured (XTTS_STORAGE_DIR)'}), 400
+        
+        try:
+            output = negotiate_output(request, data)
+            if storage_key:
+                check_storage_extension(storage_key, output.format)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         logger.info(f"🎤 Synthesizing: {language} - {text[:50]}...")
         
         # Handle speaker WAV for voice cloning
         if 'speaker_wav' in request.files:
-            wav_file = request.files['speaker_wav']
-            speaker_wav = f"/tmp/{wav_file.filename}"
-            wav_file.save(speaker_wav)
+            speaker_wav = read_upload(request.files['speaker_wav'])
             logger.info(f"📢 Using reference voice for cloning")
         
-        # Generate speech (exactly like Kaggle)
-        output_path = f"/tmp/tts_output_{os.urandom(4).hex()}.wav"
-        
-        tts.tts_to_file(
-            text=text,
-            speaker_wav=speaker_wav,
-            language=language,
-            file_path=output_path
-        )
-        
-        # Read and return
-        with open(output_path, 'rb') as f:
-            audio_data = f.read()
-        
-        # Cleanup
-        try:
-            os.remove(output_path)
-            if speaker_wav and os.path.exists(speaker_wav):
-                os.remove(speaker_wav)
-        except:
-            pass
+        # Generate speech straight into the response body
+        wav = engine.synthesize(text=text, language=language, speaker_wav=speaker_wav)
         
-        logger.info(f" Generated {len(audio_data)} bytes")
+        if storage_key:
+            audio_data, encode_time, output_rate = encoder.encode(wav, engine.sample_rate, output)
+            try:
+                store_audio(STORAGE_DIR, storage_key, audio_data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            logger.info(f" Stored {len(audio_data)} bytes as {storage_key}")
+            return jsonify({
+                'storage_key': storage_key,
+                'bytes': len(audio_data),
+                'format': output.format,
+                'sample_rate': output_rate,
+                'duration': round(len(wav) / engine.sample_rate, 3),
+                'encode_ms': round(encode_time * 1000, 1),
+            })
         
-        return send_file(
-            io.BytesIO(audio_data),
-            mimetype='audio/wav',
-            as_attachment=True,
-            download_name='output.wav'
-        )
+        response = encoder.response(wav, engine.sample_rate, output)
+        logger.info(f" Generated {response.content_length} bytes")
+        return response
     
     except Exception as e:
         logger.error(f"Error: {e}")
@@ -151,4 +150,4 @@ if __name__ == '__main__':
     print(f"   API: POST http://localhost:{port}/api/synthesize")
     print("\n" + "="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    serve(app, port=port)
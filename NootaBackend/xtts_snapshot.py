@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped snapshots of the built XTTS v2 model
+
+`TTS(...)` parses the configs, constructs every module, initializes ~2 GB of
+random weights and then overwrites them from the pickled checkpoint. A
+snapshot stores the result instead:
+
+  model.safetensors  - every parameter and persistent buffer, loaded with mmap
+  structure.pt       - the built model object with those tensors left on the
+                       meta device (a few MB: config, tokenizer, speakers)
+  manifest.json      - model name, checkpoint checksum, versions, file sizes
+                       and tied-weight aliases
+
+Loading unpickles the structure and assigns the mapped tensors in place, so
+on CPU the weights are served from the page cache: startup skips the copy,
+peak RSS stays low and forked workers share the same physical pages.
+
+Usage:
+    python xtts_snapshot.py save [--out DIR]   # build the model once and snapshot it
+    python xtts_snapshot.py check [--dir DIR]  # load the snapshot and report timings
+
+Serve with:
+    XTTS_SNAPSHOT=cache/xtts_snapshot python xtts_server.py
+
+Environment:
+  XTTS_SNAPSHOT  - snapshot directory to load instead of building the model (default: off)
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import torch
+
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+except ImportError:
+    safe_open = save_file = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'xtts_snapshot'
+)
+
+WEIGHTS_FILE = 'model.safetensors'
+STRUCTURE_FILE = 'structure.pt'
+MANIFEST_FILE = 'manifest.json'
+
+FORMAT_VERSION = 1
+
+
+def _tts_version():
+    try:
+        from TTS import __version__
+        return __version__
+    except ImportError:
+        return None
+
+
+def has_snapshot(snapshot_dir):
+    return bool(snapshot_dir) and os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE))
+
+# ============================================================================
+# SAVE
+# ============================================================================
+
+def _split_aliases(state_dict):
+    """(tensors to store, {alias: stored name}) for a state dict with tied weights
+
+    The GPT inference wrapper and tied embeddings register the same tensor
+    under several names; each is stored once and re-tied on load.
+    """
+    tensors, aliases, seen, storages = {}, {}, {}, set()
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach()
+        identity = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape), tensor.stride())
+        if identity in seen:
+            aliases[name] = seen[identity]
+            continue
+        seen[identity] = name
+
+        storage = tensor.untyped_storage().data_ptr()
+        stored = tensor.contiguous()
+        # safetensors refuses tensors that share storage, give those their own copy
+        if storage in storages and stored is tensor:
+            stored = tensor.clone()
+        tensors[name] = stored
+        storages.add(storage)
+    return tensors, aliases
+
+
+def _strip_weights(model, names):
+    """Replace the stored parameters and buffers with meta tensors, in place"""
+    for name in names:
+        module_name, _, attr = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        if attr in module._parameters:
+            param = module._parameters[attr]
+            module._parameters[attr] = torch.nn.Parameter(
+                param.detach().to('meta'), requires_grad=param.requires_grad
+            )
+        elif attr in module._buffers:
+            module._buffers[attr] = module._buffers[attr].to('meta')
+
+
+def save_snapshot(model, out_dir, model_name=None, checkpoint_sha256=None):
+    """Write a snapshot of a built (CPU, eval mode) XTTS model; the model is consumed"""
+    if save_file is None:
+        raise RuntimeError("safetensors is not installed (pip install safetensors)")
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.cpu().eval()
+    state_dict = model.state_dict()
+    tensors, aliases = _split_aliases(state_dict)
+
+    weights_path = os.path.join(out_dir, WEIGHTS_FILE)
+    save_file(tensors, weights_path, metadata={'format': 'pt'})
+    logger.info(f" Saved {len(tensors)} tensors ({len(aliases)} tied) -> {weights_path}")
+    del tensors
+
+    _strip_weights(model, state_dict.keys())
+    del state_dict
+    structure_path = os.path.join(out_dir, STRUCTURE_FILE)
+    torch.save(model, structure_path)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_name': model_name,
+        'checkpoint_sha256': checkpoint_sha256,
+        'torch_version': torch.__version__.split('+')[0],
+        'tts_version': _tts_version(),
+        'sample_rate': model.config.audio.output_sample_rate,
+        'aliases': aliases,
+        'files': {
+            name: os.path.getsize(os.path.join(out_dir, name))
+            for name in (WEIGHTS_FILE, STRUCTURE_FILE)
+        },
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f" Snapshot written to {out_dir}")
+    return manifest
+
+# ============================================================================
+# LOAD
+# ============================================================================
+
+def read_manifest(snapshot_dir, model_name=None, checkpoint_sha256=None):
+    """Manifest of a snapshot, checked against the installed versions and files
+
+    With model_name / checkpoint_sha256 the snapshot must also have been made
+    from that model and checkpoint (an unknown checksum on either side is not
+    compared).
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise RuntimeError(f"unsupported snapshot format {manifest.get('format_version')}")
+    if model_name and manifest.get('model_name') != model_name:
+        raise RuntimeError(f"snapshot is of {manifest.get('model_name')}, not {model_name}")
+    recorded = manifest.get('checkpoint_sha256')
+    if checkpoint_sha256 and recorded and recorded != checkpoint_sha256:
+        raise RuntimeError("snapshot was made from a different checkpoint")
+    # The structure is a pickle of TTS classes, only valid for the versions that wrote it
+    installed = {'torch_version': torch.__version__.split('+')[0], 'tts_version': _tts_version()}
+    for key, version in installed.items():
+        if manifest.get(key) != version:
+            raise RuntimeError(f"snapshot made with {key}={manifest.get(key)}, installed {version}")
+    for name, size in manifest['files'].items():
+        path = os.path.join(snapshot_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            raise RuntimeError(f"{name} is missing or truncated")
+    return manifest
+
+
+def load_snapshot(snapshot_dir, model_name=None, checkpoint_sha256=None):
+    """Rebuild the XTTS model from a snapshot with its weights memory-mapped (CPU)"""
+    if safe_open is None:
+        raise RuntimeError("safetensors is not installed (pip install safetensors)")
+
+    manifest = read_manifest(snapshot_dir, model_name, checkpoint_sha256)
+    model = torch.load(os.path.join(snapshot_dir, STRUCTURE_FILE), weights_only=False)
+
+    # On CPU safetensors hands out views of the mapped file, not copies
+    with safe_open(os.path.join(snapshot_dir, WEIGHTS_FILE), framework='pt', device='cpu') as f:
+        state_dict = {name: f.get_tensor(name) for name in f.keys()}
+    for alias, name in manifest['aliases'].items():
+        state_dict[alias] = state_dict[name]
+
+    # assign=True keeps the mapped tensors instead of copying into new parameters
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def _rss_mb():
+    """Peak resident set size of this process in MB (Linux/macOS)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="XTTS v2 memory-mapped snapshot tool")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    save_cmd = sub.add_parser('save', help="build the model and write a snapshot")
+    save_cmd.add_argument('--out', default=os.getenv('XTTS_SNAPSHOT') or DEFAULT_SNAPSHOT_DIR)
+
+    check_cmd = sub.add_parser('check', help="load a snapshot and report timings")
+    check_cmd.add_argument('--dir', default=os.getenv('XTTS_SNAPSHOT') or DEFAULT_SNAPSHOT_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == 'save':
+        from xtts_engine import XTTSEngine
+
+        engine = XTTSEngine(device='cpu', precision='fp32')
+        engine._download_model()
+        engine._load_model()
+        manifest = save_snapshot(engine.model, args.out, model_name=engine.model_name,
+                                 checkpoint_sha256=engine.store.checksum())
+        print(json.dumps({'dir': args.out, 'files': manifest['files']}, indent=2))
+        return 0
+
+    start = time.perf_counter()
+    model = load_snapshot(args.dir)
+    report = {
+        'dir': args.dir,
+        'load_seconds': round(time.perf_counter() - start, 2),
+        'peak_rss_mb': _rss_mb(),
+        'parameters': sum(p.numel() for p in model.parameters()),
+        'sample_rate': model.config.audio.output_sample_rate,
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
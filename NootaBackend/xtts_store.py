@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Persistent, verified local store for the XTTS v2 model files
+
+The checkpoint lives in one configurable directory that survives reboots
+(never /tmp). After a complete download the store writes checksums.json with
+the size and SHA-256 of every file; later starts verify against it, so a
+truncated or corrupted copy is re-downloaded (or refused when offline)
+instead of failing deep inside checkpoint loading.
+
+Usage:
+    python xtts_store.py preload [--accept-license]  # download and verify once
+    python xtts_store.py verify                      # full checksum check
+
+Environment:
+  XTTS_MODEL_DIR     - store directory (default: TTS_HOME, else cache/models)
+  XTTS_OFFLINE       - 1 to never touch the network; a missing model is an error (default: 0)
+  XTTS_MODEL_VERIFY  - size | full | off, check done at startup (default: size)
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'models'
+)
+
+DEFAULT_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+
+MANIFEST_FILE = 'checksums.json'
+
+# Present in every complete XTTS v2 download
+REQUIRED_FILES = ('config.json', 'model.pth', 'vocab.json')
+
+VERIFY_MODES = ('size', 'full', 'off')
+
+
+def file_sha256(path, block_size=4 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """Model files for one TTS model name under a persistent root directory"""
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, root=None, offline=None, verify=None):
+        self.model_name = model_name
+        self.root = os.path.abspath(
+            root or os.getenv('XTTS_MODEL_DIR') or os.getenv('TTS_HOME') or DEFAULT_STORE_DIR
+        )
+        self.offline = os.getenv('XTTS_OFFLINE', '0') == '1' if offline is None else offline
+        self.verify_mode = (verify or os.getenv('XTTS_MODEL_VERIFY', 'size')).lower()
+        if self.verify_mode not in VERIFY_MODES:
+            logger.warning(f"Unknown XTTS_MODEL_VERIFY '{self.verify_mode}', using size")
+            self.verify_mode = 'size'
+        # Same layout as the TTS model manager: <TTS_HOME>/tts/<type--lang--dataset--model>
+        self.model_dir = os.path.join(self.root, 'tts', model_name.replace('/', '--'))
+
+    def configure(self):
+        """Point TTS (and, offline, the Hugging Face libraries) at this store"""
+        os.makedirs(self.root, exist_ok=True)
+        os.environ['TTS_HOME'] = self.root
+        if self.offline:
+            os.environ['HF_HUB_OFFLINE'] = '1'
+            os.environ['TRANSFORMERS_OFFLINE'] = '1'
+        return self
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.model_dir, MANIFEST_FILE)
+
+    def has_manifest(self):
+        return os.path.exists(self.manifest_path)
+
+    def _model_files(self):
+        names = []
+        for root, _, files in os.walk(self.model_dir):
+            for name in files:
+                path = os.path.relpath(os.path.join(root, name), self.model_dir)
+                if path != MANIFEST_FILE:
+                    names.append(path)
+        return sorted(names)
+
+    def checksum(self, name='model.pth'):
+        """Recorded SHA-256 of a stored file, None before checksums are recorded"""
+        if not self.has_manifest():
+            return None
+        with open(self.manifest_path) as f:
+            return json.load(f)['files'].get(name, {}).get('sha256')
+
+    def verify(self, mode=None):
+        """List of problems with the stored files ([] when usable)"""
+        mode = mode or self.verify_mode
+        if not os.path.isdir(self.model_dir):
+            return ['not downloaded']
+
+        problems = [f"{name} missing" for name in REQUIRED_FILES
+                    if not os.path.exists(os.path.join(self.model_dir, name))]
+        if problems or mode == 'off' or not self.has_manifest():
+            return problems
+
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        for name, expected in manifest['files'].items():
+            path = os.path.join(self.model_dir, name)
+            if not os.path.exists(path):
+                problems.append(f"{name} missing")
+            elif os.path.getsize(path) != expected['size']:
+                problems.append(f"{name} is {os.path.getsize(path)} bytes, expected {expected['size']}")
+            elif mode == 'full' and file_sha256(path) != expected['sha256']:
+                problems.append(f"{name} checksum mismatch")
+        return problems
+
+    def record(self):
+        """Write checksums.json for the files currently in the store"""
+        files = {
+            name: {
+                'size': os.path.getsize(os.path.join(self.model_dir, name)),
+                'sha256': file_sha256(os.path.join(self.model_dir, name)),
+            }
+            for name in self._model_files()
+        }
+        manifest = {'model_name': self.model_name, 'files': files}
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        logger.info(f" Recorded checksums for {len(files)} model files in {self.manifest_path}")
+        return manifest
+
+    def download(self):
+        """Download the model into the store with the TTS model manager"""
+        from TTS.utils.manage import ModelManager
+
+        # The manager appends "tts" itself, which gives self.model_dir
+        manager = ModelManager(output_prefix=self.root, progress_bar=False)
+        manager.download_model(self.model_name)
+        self.record()
+
+    def ensure(self):
+        """Make sure a usable copy is stored, downloading it unless offline"""
+        problems = self.verify()
+        if not problems:
+            return False
+
+        if self.offline:
+            raise RuntimeError(
+                f"Model store {self.model_dir} is not usable in offline mode ({'; '.join(problems)}). "
+                f"Provision it with: python xtts_store.py preload"
+            )
+        if os.path.isdir(self.model_dir):
+            # The model manager skips existing directories, so remove the broken copy
+            logger.warning(f"Model store {self.model_dir} is incomplete ({'; '.join(problems)}), "
+                           f"downloading again")
+            shutil.rmtree(self.model_dir)
+
+        logger.info(f"Downloading {self.model_name} into {self.model_dir}...")
+        self.download()
+        return True
+
+    def info(self):
+        return {
+            'dir': self.model_dir,
+            'offline': self.offline,
+            'verify': self.verify_mode,
+            'verified': self.has_manifest(),
+        }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="XTTS v2 model store")
+    parser.add_argument('--dir', help="store directory (default: XTTS_MODEL_DIR)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    preload_cmd = sub.add_parser('preload', help="download and verify the model once")
+    preload_cmd.add_argument('--accept-license', action='store_true',
+                             help="agree to the Coqui Public Model License non-interactively")
+    sub.add_parser('verify', help="check every file against checksums.json")
+
+    args = parser.parse_args()
+    store = ModelStore(root=args.dir, offline=False).configure()
+
+    if args.command == 'preload':
+        if args.accept_license:
+            os.environ['COQUI_TOS_AGREED'] = '1'
+        store.ensure()
+        if not store.has_manifest():
+            store.record()
+
+    problems = store.verify(mode='full')
+    if not problems and not store.has_manifest():
+        problems.append(f"no {MANIFEST_FILE} (run: python xtts_store.py preload)")
+    print(json.dumps({**store.info(), 'problems': problems}, indent=2))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
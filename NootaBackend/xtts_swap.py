@@ -0,0 +1,207 @@
+"""
+Zero-downtime engine hot swap for the XTTS servers
+
+An EngineSlot holds the engine that serves new requests. A swap builds and
+loads (including warmup) a replacement next to it, points new requests at
+the replacement, waits for the requests still running on the old engine to
+finish and then unloads it. Both engines are resident during the swap, so
+the host needs room for two models.
+
+Environment:
+  XTTS_ADMIN_TOKEN          - bearer token for the /admin endpoints (default: admin API off)
+  XTTS_SWAP_DRAIN_TIMEOUT   - seconds to wait for in-flight requests on the old engine (default: 300)
+"""
+
+import os
+import hmac
+import time
+import logging
+import threading
+import contextlib
+
+from flask import g, has_request_context, jsonify, request
+from werkzeug.local import LocalProxy
+
+from xtts_engine import create_engine
+
+logger = logging.getLogger(__name__)
+
+# Settings a swap may change; anything else comes from the environment as usual
+SWAP_SETTINGS = ('model_name', 'backend', 'device', 'precision', 'snapshot')
+
+
+class EngineSlot:
+    """The serving engine, per-engine in-flight counts and the latest swap"""
+
+    def __init__(self, engine):
+        self.current = engine
+        self.generation = 1
+        self.swap = None
+        self._in_flight = {}
+        self._candidate = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Pin the current engine for one request"""
+        with self._cond:
+            engine = self.current
+            self._in_flight[id(engine)] = self._in_flight.get(id(engine), 0) + 1
+            return engine
+
+    def release(self, engine):
+        with self._cond:
+            remaining = self._in_flight.get(id(engine), 0) - 1
+            if remaining > 0:
+                self._in_flight[id(engine)] = remaining
+            else:
+                self._in_flight.pop(id(engine), None)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def use(self):
+        """with slot.use() as engine: ... (for callers outside Flask, e.g. gRPC)"""
+        engine = self.acquire()
+        try:
+            yield engine
+        finally:
+            self.release(engine)
+
+    def in_flight(self, engine=None):
+        with self._cond:
+            return self._in_flight.get(id(engine or self.current), 0)
+
+    def start_swap(self, settings):
+        """Load a replacement engine in the background; raises if a swap is running"""
+        unknown = set(settings) - set(SWAP_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown engine settings: {', '.join(sorted(unknown))}")
+
+        with self._cond:
+            if self.swap and self.swap['state'] in ('loading', 'draining'):
+                raise RuntimeError("An engine swap is already in progress")
+            self.swap = {
+                'state': 'loading',
+                'settings': settings,
+                'from_generation': self.generation,
+                'started_at': time.time(),
+            }
+        threading.Thread(target=self._swap, args=(dict(settings),), name='xtts-swap',
+                         daemon=True).start()
+        return self.status()
+
+    def _swap(self, settings):
+        start = time.perf_counter()
+        snapshot = settings.pop('snapshot', None)
+        try:
+            engine = create_engine(**settings)
+            if snapshot is not None:
+                engine.snapshot_dir = snapshot
+            elif engine.model_name != self.current.model_name:
+                # XTTS_SNAPSHOT holds the serving model; never build another model from it
+                engine.snapshot_dir = None
+            self._candidate = engine
+            engine.load()
+        except Exception as e:
+            logger.error(f"Engine swap failed, keeping the current engine: {e}")
+            self._finish('failed', start, error=str(e))
+            return
+        finally:
+            self._candidate = None
+
+        with self._cond:
+            old = self.current
+            engine.adopt_voices(old)
+            self.current = engine
+            self.generation += 1
+            self.swap['state'] = 'draining'
+            self.swap['loaded_seconds'] = round(time.perf_counter() - start, 1)
+        logger.info(f" Engine generation {self.generation} is serving, draining the old engine")
+
+        timeout = float(os.getenv('XTTS_SWAP_DRAIN_TIMEOUT', 300))
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight.get(id(old)) and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            abandoned = self._in_flight.get(id(old), 0)
+        if abandoned:
+            # Unloading would fail them; the old engine is freed when the last one
+            # drops its reference instead
+            logger.warning(f"{abandoned} request(s) still on the old engine after {timeout:.0f}s")
+        else:
+            old.unload()
+        del old
+        self._finish('done', start, abandoned_requests=abandoned)
+
+    def _finish(self, state, start, **details):
+        with self._cond:
+            self.swap.update(state=state, seconds=round(time.perf_counter() - start, 1), **details)
+        logger.info(f" Engine swap {state} in {self.swap['seconds']}s")
+
+    def status(self):
+        """Serving generation, in-flight requests and the latest swap for /health"""
+        with self._cond:
+            swap = dict(self.swap) if self.swap else None
+            in_flight = self._in_flight.get(id(self.current), 0)
+        candidate = self._candidate
+        if swap and candidate is not None:
+            swap['engine'] = candidate.load_status()
+        return {'generation': self.generation, 'in_flight': in_flight, 'swap': swap}
+
+# ============================================================================
+# FLASK
+# ============================================================================
+
+def serve_engine_slot(app, slot):
+    """Pin each request to one engine and return a proxy for the views to use
+
+    The proxy resolves to the request's pinned engine, or to the serving
+    engine outside a request. Streaming responses keep their engine until
+    the stream ends.
+    """
+    @app.before_request
+    def pin_engine():
+        g.engine = slot.acquire()
+
+    @app.teardown_request
+    def unpin_engine(error=None):
+        engine = g.pop('engine', None)
+        if engine is not None:
+            slot.release(engine)
+
+    def current():
+        if has_request_context() and 'engine' in g:
+            return g.engine
+        return slot.current
+
+    return LocalProxy(current)
+
+
+def admin_routes(app, slot):
+    """POST /admin/engine/reload and GET /admin/engine, enabled by XTTS_ADMIN_TOKEN"""
+    token = os.getenv('XTTS_ADMIN_TOKEN')
+
+    def authorized():
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+    @app.route('/admin/engine', methods=['GET'])
+    def engine_status():
+        if not authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        return jsonify({**slot.status(), 'engine': slot.current.info()})
+
+    @app.route('/admin/engine/reload', methods=['POST'])
+    def reload_engine():
+        """Body: {"model_name", "backend", "device", "precision", "snapshot"}, all optional"""
+        if not authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        settings = request.get_json(silent=True) or {}
+        if not isinstance(settings, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        try:
+            status = slot.start_swap(settings)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e), **slot.status()}), 409
+        return jsonify(status), 202
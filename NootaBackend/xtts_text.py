@@ -0,0 +1,111 @@
+"""
+Text segmentation for the XTTS v2 engine
+
+Splits a whole message into sentences (keeping their punctuation) and packs
+them into segments that stay under the model's text-token limit and the
+amount of speech one GPT generation can hold for the language. Oversized
+sentences are broken at clause punctuation, then at word boundaries, and
+finally (for scripts without spaces) at character boundaries.
+"""
+
+import re
+
+# Sentence terminators: Latin/Arabic/Devanagari ones must be followed by
+# whitespace (so "3.5" or "e.g" stay intact), full-width CJK ones end a
+# sentence immediately. Closing quotes/brackets stay with the sentence.
+SENTENCE_END = re.compile(
+    r'.+?(?:[.!?؟۔।…]+[\"\'”’»)\]]*(?=\s|$)'
+    r'|[。！？]+[”’」』）]*'
+    r'|\n+|$)',
+    re.S,
+)
+
+# Clause separators used to break a sentence that is too long on its own
+CLAUSE_END = re.compile(r'.+?(?:[,;:،؛、，；：—]+|$)', re.S)
+
+# Languages written without spaces between words
+NO_SPACE_LANGUAGES = {'zh', 'ja'}
+
+# App language code -> XTTS v2 language code
+SUPPORTED_LANGUAGES = {
+    "en": "en",
+    "ar": "ar",
+    "tr": "tr",
+    "es": "es",
+    "fr": "fr",
+    "de": "de",
+    "it": "it",
+    "pt": "pt",
+    "zh": "zh-cn",
+    "ja": "ja",
+    "ko": "ko"
+}
+
+
+def split_sentences(text):
+    """Split text into sentences, keeping terminal punctuation attached"""
+    sentences = []
+    for match in SENTENCE_END.finditer(text):
+        sentence = ' '.join(match.group(0).split())
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def _split_clauses(sentence):
+    return [c.strip() for c in CLAUSE_END.findall(sentence) if c.strip()]
+
+
+def _split_words(sentence, lang):
+    if lang in NO_SPACE_LANGUAGES:
+        return list(sentence)
+    return sentence.split()
+
+
+def _separator(lang):
+    return '' if lang in NO_SPACE_LANGUAGES else ' '
+
+
+def _pack(parts, separator, fits):
+    """Greedily join consecutive parts while the result still fits"""
+    segments = []
+    current = []
+    for part in parts:
+        if current and not fits(separator.join(current + [part])):
+            segments.append(separator.join(current))
+            current = [part]
+        else:
+            current.append(part)
+    if current:
+        segments.append(separator.join(current))
+    return segments
+
+
+def segment_text(text, lang, count_tokens, max_tokens, max_chars):
+    """Pack sentences into segments of at most max_tokens text tokens and max_chars characters
+
+    count_tokens(text) must return the number of model tokens for text in lang.
+    """
+    def fits(candidate):
+        # The character check is cheap and rules out most candidates before tokenizing
+        return len(candidate) <= max_chars and count_tokens(candidate) <= max_tokens
+
+    separator = _separator(lang)
+    units = []
+    for sentence in split_sentences(text):
+        if fits(sentence):
+            units.append(sentence)
+            continue
+
+        # Sentence alone is too long: clauses, then words, then characters
+        for clause in _pack(_split_clauses(sentence), separator, fits):
+            if fits(clause):
+                units.append(clause)
+                continue
+            for piece in _pack(_split_words(clause, lang), separator, fits):
+                if fits(piece):
+                    units.append(piece)
+                else:
+                    units.extend(_pack(list(piece), '', fits))
+
+    return _pack(units, separator, fits)
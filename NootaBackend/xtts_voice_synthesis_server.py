@@ -5,54 +5,45 @@ import os
 import sys
 import torch
 import logging
-from flask import Flask, request, jsonify, send_file
-from TTS.api import TTS
-import io
+from flask import Flask, request, jsonify
+from xtts_engine import XTTSEngine
+from xtts_audio import AudioEncoder, negotiate_output
+from xtts_http import serve, health_routes, limit_request_bodies, metrics_routes
+from xtts_text import SUPPORTED_LANGUAGES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+limit_request_bodies(app)
 
 # Check device availability
-device = "cuda" if torch.cuda.is_available() else "cpu"
+engine = XTTSEngine()
+encoder = AudioEncoder()
+device = engine.device
 logger.info(f"Using device: {device}")
 
-# Load XTTS v2 model
-try:
-    logger.info("Loading XTTS v2 model...")
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True, gpu=(device == "cuda"))
-    logger.info("XTTS v2 model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load XTTS model: {e}")
-    sys.exit(1)
-
-# Language code mapping
-SUPPORTED_LANGUAGES = {
-    "en": "en",
-    "ar": "ar",
-    "tr": "tr",
-    "es": "es",
-    "fr": "fr",
-    "de": "de",
-    "it": "it",
-    "pt": "pt",
-    "zh": "zh-cn",
-    "ja": "ja",
-    "ko": "ko"
-}
+# Load XTTS v2 model in the background (a failed load shows on /health/live)
+logger.info("Loading XTTS v2 model...")
+engine.load_in_background()
+health_routes(app, engine)
+metrics_routes(app, engine)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
-        "status": "healthy",
+        "status": "healthy" if engine.ready else engine.state,
+        "startup": engine.load_status(),
         "device": device,
         "model": "XTTS v2"
     })
 
 @app.route('/generate', methods=['POST'])
 def generate_speech():
+    if not engine.ready:
+        return jsonify({"error": "XTTS model not ready", "state": engine.state}), 503
+
     try:
         data = request.get_json()
         
@@ -69,6 +60,11 @@ def generate_speech():
         # Validate text
         if not text or len(text.strip()) == 0:
             return jsonify({"error": "Text cannot be empty"}), 400
+
+        try:
+            output = negotiate_output(request, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Validate language
         if language not in SUPPORTED_LANGUAGES:
@@ -85,35 +81,20 @@ def generate_speech():
             # If speaker audio is provided, use it for voice cloning
             if speaker_audio_path and os.path.exists(speaker_audio_path):
                 logger.info(f"Using speaker reference: {speaker_audio_path}")
-                output_path = "/tmp/tts_output.wav"
-                tts.tts_to_file(
-                    text=text,
-                    speaker_wav=speaker_audio_path,
-                    language=language_code,
-                    file_path=output_path
-                )
             else:
                 # Use default voice if no speaker reference
                 logger.warning("No speaker reference provided, using default voice")
-                output_path = "/tmp/tts_output.wav"
-                tts.tts_to_file(
-                    text=text,
-                    language=language_code,
-                    file_path=output_path
-                )
+                speaker_audio_path = None
             
-            # Read generated audio
-            with open(output_path, 'rb') as f:
-                audio_data = f.read()
-            
-            logger.info(f"Speech generated successfully ({len(audio_data)} bytes)")
-            
-            return send_file(
-                io.BytesIO(audio_data),
-                mimetype="audio/wav",
-                as_attachment=True,
-                download_name="synthesis.wav"
+            wav = engine.synthesize(
+                text=text,
+                language=language_code,
+                speaker_wav=speaker_audio_path
             )
+            
+            response = encoder.response(wav, engine.sample_rate, output, download_name="synthesis.wav")
+            logger.info(f"Speech generated successfully ({response.content_length} bytes)")
+            return response
         
         except Exception as synthesis_error:
             logger.error(f"Synthesis error: {synthesis_error}")
@@ -137,4 +118,4 @@ def get_supported_languages():
 if __name__ == '__main__':
     port = os.getenv('XTTS_PORT', 8000)
     logger.info(f"Starting XTTS v2 server on port {port}")
-    app.run(host='0.0.0.0', port=int(port), debug=False)
+    serve(app, port=int(port))
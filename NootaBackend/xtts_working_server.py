@@ -10,9 +10,11 @@ import json
 import torch
 import logging
 from pathlib import Path
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-import io
+from xtts_engine import XTTSEngine
+from xtts_audio import AudioEncoder, negotiate_output
+from xtts_http import serve, health_routes, limit_request_bodies, metrics_routes, read_upload
 
 # ============================================================================
 # 1. CRITICAL FIXES FOR XTTS v2 (من كود Kaggle بتاعك اللي اشتغل)
@@ -34,33 +36,24 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+limit_request_bodies(app)
 
 # ============================================================================
 # 3. INITIALIZE XTTS v2 MODEL
 # ============================================================================
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+engine = XTTSEngine()
+encoder = AudioEncoder()
+device = engine.device
 logger.info(f"🖥️  Using device: {device}")
 
-try:
-    logger.info("جاري تحميل نموذج XTTS V2...")
-    logger.info("Loading XTTS v2 model (this will take a moment)...")
-    
-    from TTS.api import TTS
-    
-    # Load exactly like Kaggle works
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True).to(device)
-    
-    logger.info(" انتهى تحميل نموذج XTTS V2 بنجاح!")
-    logger.info(" XTTS v2 model loaded successfully!")
-    TTS_MODEL = tts
-    TTS_READY = True
-    
-except Exception as e:
-    logger.error(f"Failed to load XTTS model: {e}")
-    logger.error(f"خطأ في تحميل النموذج: {e}")
-    TTS_MODEL = None
-    TTS_READY = False
+logger.info("جاري تحميل نموذج XTTS V2...")
+logger.info("Loading XTTS v2 model in the background (this will take a moment)...")
+
+# The HTTP socket is up while the model loads; /health reports the stage
+engine.load_in_background()
+health_routes(app, engine)
+metrics_routes(app, engine)
 
 # ============================================================================
 # 4. ENDPOINTS
@@ -70,11 +63,12 @@ except Exception as e:
 def health():
     """Health check endpoint"""
     return jsonify({
-        'status': 'healthy' if TTS_READY else 'error',
+        'status': 'healthy' if engine.ready else ('error' if engine.state == 'failed' else 'loading'),
+        'startup': engine.load_status(),
         'model': 'XTTS v2',
         'device': device,
         'cuda_available': torch.cuda.is_available(),
-        'message': 'XTTS v2 Ready' if TTS_READY else 'Model not loaded'
+        'message': 'XTTS v2 Ready' if engine.ready else f'Model {engine.state}'
     })
 
 @app.route('/generate', methods=['POST'])
@@ -92,8 +86,8 @@ def generate_speech():
     Returns: WAV audio file
     """
     
-    if not TTS_READY:
-        return jsonify({'error': 'XTTS model not ready'}), 503
+    if not engine.ready:
+        return jsonify({'error': 'XTTS model not ready', 'state': engine.state}), 503
     
     try:
         # Get request data
@@ -104,11 +98,16 @@ def generate_speech():
         
         text = data.get('text', '')
         language = data.get('language', 'en')
-        speaker_wav_path = None
+        speaker_wav = None
         
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
+        try:
+            output = negotiate_output(request, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         logger.info(f"🎤 Generating speech for language: {language}")
         logger.info(f" Text: {text[:50]}...")
         
@@ -116,55 +115,30 @@ def generate_speech():
         if 'speaker_wav' in request.files:
             # File uploaded
             wav_file = request.files['speaker_wav']
-            speaker_wav_path = f"/tmp/{wav_file.filename}"
-            wav_file.save(speaker_wav_path)
-            logger.info(f"📢 Using reference voice for cloning: {speaker_wav_path}")
+            speaker_wav = read_upload(wav_file)
+            logger.info(f"📢 Using reference voice for cloning: {wav_file.filename}")
         elif 'speaker_wav' in data and data['speaker_wav']:
             # Path provided
-            speaker_wav_path = data['speaker_wav']
-            if os.path.exists(speaker_wav_path):
-                logger.info(f"📢 Using reference voice: {speaker_wav_path}")
+            speaker_wav = data['speaker_wav']
+            if os.path.exists(speaker_wav):
+                logger.info(f"📢 Using reference voice: {speaker_wav}")
             else:
-                logger.warn(f" Reference voice file not found: {speaker_wav_path}")
-                speaker_wav_path = None
+                logger.warn(f" Reference voice file not found: {speaker_wav}")
+                speaker_wav = None
         
         # Generate speech using XTTS (exactly like Kaggle code)
         logger.info(f"🔊 Calling XTTS v2 for {language}...")
         
-        output_path = f"/tmp/tts_output_{os.urandom(4).hex()}.wav"
-        
-        # Call tts_to_file exactly like Kaggle
-        TTS_MODEL.tts_to_file(
+        wav = engine.synthesize(
             text=text,
-            speaker_wav=speaker_wav_path,  # Can be None for default voice
             language=language,
-            file_path=output_path
+            speaker_wav=speaker_wav  # Path, uploaded bytes, or None for default voice
         )
         
-        # Read the generated file
-        if not os.path.exists(output_path):
-            return jsonify({'error': 'Failed to generate audio'}), 500
-        
-        with open(output_path, 'rb') as f:
-            audio_data = f.read()
-        
-        # Cleanup
-        try:
-            os.remove(output_path)
-            if speaker_wav_path and speaker_wav_path.startswith('/tmp/'):
-                os.remove(speaker_wav_path)
-        except:
-            pass
-        
-        logger.info(f" Speech generated successfully ({len(audio_data)} bytes)")
-        
-        # Return audio file
-        return send_file(
-            io.BytesIO(audio_data),
-            mimetype='audio/wav',
-            as_attachment=True,
-            download_name='output.wav'
-        )
+        # Return audio straight from memory
+        response = encoder.response(wav, engine.sample_rate, output)
+        logger.info(f" Speech generated successfully ({response.content_length} bytes)")
+        return response
     
     except Exception as e:
         logger.error(f"Error during speech generation: {str(e)}")
@@ -189,7 +163,7 @@ if __name__ == '__main__':
     logger.info("Starting XTTS v2 Server...")
     logger.info(f"🌐 Server running at: http://localhost:{port}")
     logger.info(f"🖥️  Device: {device}")
-    logger.info(f" Model Status: {'Ready' if TTS_READY else 'Error'}")
+    logger.info(f" Model Status: {engine.state}")
     logger.info("="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    serve(app, port=port)